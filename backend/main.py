@@ -1,18 +1,26 @@
+import json
+import time
 import logging
 import sys
 import os
-from itertools import count
+import uuid
 from typing import Literal
 from pathlib import Path
 
-from fastapi import Body, FastAPI
+from fastapi import Body, Depends, FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from backend.utils.rag import RAG
 from backend.utils.downloader import Downloader
+from backend.utils.config_loader import config
+from backend.utils.neo4j_client import Neo4jClient
+from backend.utils.metrics import metrics
+from backend.utils.conversations import ConversationStore
+from backend.utils.concurrency import AdmissionController, Overloaded, llm_priority
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -26,6 +34,11 @@ class Message(BaseModel):
     content: str
 
 
+class BatchRequest(BaseModel):
+    questions: list[str] = Field(min_length=1, max_length=config.batch.max_questions)
+    concurrency: int = Field(default=config.batch.concurrency, ge=1, le=64)
+
+
 app = FastAPI(title="AITH Demo Backend", version="0.1.0")
 
 app.add_middleware(
@@ -42,29 +55,118 @@ app.add_middleware(
 
 logger = logging.getLogger(__name__)
 
+http_requests = metrics.counter(
+    "http_requests_total", "HTTP requests", ("method", "path", "status")
+)
+http_request_seconds = metrics.histogram(
+    "http_request_seconds", "HTTP request latency until response start", ("path",)
+)
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    http_requests.inc(method=request.method, path=path, status=response.status_code)
+    http_request_seconds.observe(time.perf_counter() - start, path=path)
+    return response
+
+
+admission = AdmissionController(
+    max_concurrency=config.server.max_concurrent_requests,
+    max_queue=config.server.max_queued_requests,
+    queue_timeout=config.server.queue_timeout,
+)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded) -> JSONResponse:
+    logger.warning(f"Запрос отклонен: {exc}")
+    return JSONResponse(
+        status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"}
+    )
+
+
+async def admitted():
+    """Слот обработки запроса к RAG; держится до конца ответа, включая поток"""
+    async with admission.admit():
+        yield
+
+
 rag = None
+neo4j_client = None
 
 
 @app.on_event("startup")
 async def startup_event():
-    global rag
+    global rag, neo4j_client
     if os.getenv("RELOAD", "0") == "1":
         return
     downloader = Downloader()
     await downloader.download()
+    if neo4j_client is None:
+        neo4j_client = Neo4jClient(config)
+        await neo4j_client.verify()
     if rag is None:
-        rag = RAG()
+        rag = RAG(neo4j_client=neo4j_client)
+        await rag.graph_health.refresh()
         logger.info("RAG система инициализирована")
 
 
-_ids = count(1)
-_messages = [
-    Message(
-        id=next(_ids),
-        role="assistant",
-        content="Привет! Я помощник по роману 'Граф Монте-Кристо'. Задайте мне вопрос о романе!",
+@app.on_event("shutdown")
+async def shutdown_event():
+    global neo4j_client
+    if rag is not None:
+        await rag.graph_health.close()
+    if neo4j_client is not None:
+        await neo4j_client.close()
+        neo4j_client = None
+    conversations.close()
+
+
+conversations = ConversationStore(
+    max_messages=config.conversations.max_messages,
+    max_sessions=config.conversations.max_sessions,
+    idle_ttl=config.conversations.idle_ttl,
+    greeting="Привет! Я помощник по роману 'Граф Монте-Кристо'. Задайте мне вопрос о романе!",
+    path=config.conversations.path,
+    retention=config.conversations.retention,
+)
+
+SESSION_HEADER = "X-Session-Id"
+SESSION_COOKIE = "session_id"
+
+
+ERROR_CONTENT = (
+    "Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз."
+)
+
+
+def _get_session_id(request: Request) -> tuple[str, bool]:
+    """Идентификатор сессии из заголовка или cookie; новый, если их нет"""
+    session_id = request.headers.get(SESSION_HEADER) or request.cookies.get(
+        SESSION_COOKIE
     )
-]
+    if session_id and len(session_id) <= 128:
+        return session_id, False
+    return uuid.uuid4().hex, True
+
+
+def _remember_session(response: Response, session_id: str, is_new: bool) -> None:
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+
+
+async def _get_chat_history(session_id: str) -> list[dict[str, str]]:
+    return await conversations.ahistory(
+        session_id, config.conversations.history_messages
+    )
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
 @app.get("/health")
@@ -72,24 +174,43 @@ async def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """Prometheus text exposition of request, stage, cache and token metrics."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/api/messages", response_model=list[Message])
-async def get_messages() -> list[Message]:
-    return _messages
+async def get_messages(
+    request: Request, response: Response, after_id: int = 0
+) -> list[Message]:
+    """
+    Messages of the caller's session (X-Session-Id header or session_id cookie).
+    With after_id only messages newer than that id are returned.
+    """
+    session_id, is_new = _get_session_id(request)
+    _remember_session(response, session_id, is_new)
+    return [
+        Message(**msg) for msg in await conversations.amessages(session_id, after_id)
+    ]
 
 
-@app.post("/api/messages", response_model=Message)
-async def post_message(message_text: str = Body(..., embed=False)) -> Message:
+@app.post("/api/messages", response_model=Message, dependencies=[Depends(admitted)])
+async def post_message(
+    request: Request, response: Response, message_text: str = Body(..., embed=False)
+) -> Message:
     """
     Accepts a plain string body (e.g. axios.post('/api/messages', 'hi')).
     Stores the user message and uses RAG to generate an assistant reply.
     """
-    user_message = Message(id=next(_ids), role="user", content=message_text)
-    _messages.append(user_message)
+    session_id, is_new = _get_session_id(request)
+    _remember_session(response, session_id, is_new)
+    await conversations.aappend(session_id, "user", message_text)
 
     try:
-        chat_history = []
-        for msg in _messages[-10:]:
-            chat_history.append({"role": msg.role, "content": msg.content})
+        chat_history = await _get_chat_history(session_id)
 
         logger.info(f"Обработка запроса: {message_text[:50]}...")
         rag_result = await rag.run(query=message_text, chat_history=chat_history)
@@ -99,9 +220,8 @@ async def post_message(message_text: str = Body(..., embed=False)) -> Message:
         )
 
         assistant_reply = Message(
-            id=next(_ids), role="assistant", content=answer_content
+            **await conversations.aappend(session_id, "assistant", answer_content)
         )
-        _messages.append(assistant_reply)
 
         logger.info(f"Ответ сгенерирован. Длина: {len(answer_content)} символов")
         if rag_result.get("graph_metadata"):
@@ -113,10 +233,71 @@ async def post_message(message_text: str = Body(..., embed=False)) -> Message:
 
     except Exception as e:
         logger.error(f"Ошибка при обработке запроса: {e}", exc_info=True)
-        error_message = Message(
-            id=next(_ids),
-            role="assistant",
-            content="Извините, произошла ошибка при обработке вашего запроса. Попробуйте еще раз.",
+        return Message(
+            **await conversations.aappend(session_id, "assistant", ERROR_CONTENT)
+        )
+
+
+@app.post("/api/messages/stream", dependencies=[Depends(admitted)])
+async def post_message_stream(
+    request: Request, message_text: str = Body(..., embed=False)
+) -> StreamingResponse:
+    """
+    Streaming variant of POST /api/messages (Server-Sent Events).
+    Emits "metadata" once graph retrieval is done, then "token" events with answer
+    chunks and finally "done" with the stored assistant message.
+    """
+    session_id, is_new = _get_session_id(request)
+    await conversations.aappend(session_id, "user", message_text)
+    chat_history = await _get_chat_history(session_id)
+
+    async def event_stream():
+        answer_content = ""
+        try:
+            logger.info(f"Обработка потокового запроса: {message_text[:50]}...")
+            async for event in rag.run_stream(
+                query=message_text, chat_history=chat_history
+            ):
+                if event["event"] == "done":
+                    answer_content = event["data"]["answer"]
+                    continue
+                yield _sse(event["event"], event["data"])
+        except Exception as e:
+            logger.error(f"Ошибка при обработке запроса: {e}", exc_info=True)
+            answer_content = ERROR_CONTENT
+
+        assistant_reply = Message(
+            **await conversations.aappend(session_id, "assistant", answer_content)
         )
-        _messages.append(error_message)
-        return error_message
+        yield _sse("done", assistant_reply.model_dump())
+
+    response = StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    _remember_session(response, session_id, is_new)
+    return response
+
+
+@app.post("/api/batch", dependencies=[Depends(admitted)])
+async def post_batch(batch: BatchRequest) -> StreamingResponse:
+    """
+    Answers many questions at once without touching any chat history.
+    Streams NDJSON, one line per question as soon as its answer is ready:
+    {"index": ..., "question": ..., "answer": ..., ...} or {"index", "question", "error"}.
+    """
+
+    async def result_stream():
+        logger.info(f"Обработка пакета из {len(batch.questions)} вопросов")
+        try:
+            with llm_priority("evaluation"):
+                async for result in rag.run_batch(
+                    batch.questions, concurrency=batch.concurrency
+                ):
+                    yield json.dumps(result, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Ошибка при обработке пакета: {e}", exc_info=True)
+            yield json.dumps({"error": ERROR_CONTENT}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
@@ -0,0 +1,107 @@
+import re
+import json
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста: регистр, ё/е, пунктуация и лишние пробелы"""
+    text = text.lower().replace("ё", "е")
+    return re.sub(r"[^a-zа-я0-9]+", " ", text).strip()
+
+
+def _trigrams(name: str) -> Set[str]:
+    padded = f"  {name} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class AliasResolver:
+    """Индекс псевдонимов: псевдоним -> каноническое имя"""
+
+    def __init__(self, names_map: Dict[str, List[str]], min_similarity: float = 0.7):
+        self.min_similarity = min_similarity
+        self._exact: Dict[str, str] = {}
+        self._normalized: Dict[str, str] = {}
+        self._trigrams: Dict[str, List[str]] = defaultdict(list)
+        self._trigram_sizes: Dict[str, int] = {}
+
+        # сначала псевдонимы, затем сами канонические имена: при конфликте
+        # побеждает первое вхождение, как при последовательном обходе карты
+        pairs = [
+            (alias, canonical)
+            for canonical, aliases in names_map.items()
+            for alias in aliases
+        ]
+        pairs.extend((canonical, canonical) for canonical in names_map)
+        for alias, canonical in pairs:
+            self._exact.setdefault(alias.lower(), canonical)
+            normalized = normalize_text(alias)
+            if normalized and normalized not in self._normalized:
+                self._normalized[normalized] = canonical
+                trigrams = _trigrams(normalized)
+                self._trigram_sizes[normalized] = len(trigrams)
+                for trigram in trigrams:
+                    self._trigrams[trigram].append(normalized)
+
+    @classmethod
+    def from_file(
+        cls, path: str = "./backend/data/names_map.json", min_similarity: float = 0.7
+    ) -> "AliasResolver":
+        """Построение индекса по карте имен из файла"""
+
+        names_map_path = Path(path)
+        names_map = {}
+        if names_map_path.exists():
+            try:
+                names_map = json.loads(names_map_path.read_text(encoding="utf-8"))
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить {path}: {e}")
+        else:
+            logger.warning(f"Файл {path} не найден. Работаем без канонизации имен.")
+
+        return cls(names_map, min_similarity)
+
+    def items(self) -> List[Tuple[str, str]]:
+        """Пары (псевдоним, каноническое имя)"""
+        return list(self._exact.items())
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def _fuzzy_lookup(self, normalized: str) -> Optional[str]:
+        """Поиск ближайшего псевдонима по сходству триграмм (Жаккар)"""
+
+        trigrams = _trigrams(normalized)
+        shared: Dict[str, int] = defaultdict(int)
+        for trigram in trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+
+        best, best_score = None, 0.0
+        for candidate, count in shared.items():
+            union = len(trigrams) + self._trigram_sizes[candidate] - count
+            score = count / union
+            if score > best_score:
+                best, best_score = candidate, score
+
+        if best is None or best_score < self.min_similarity:
+            return None
+        return self._normalized[best]
+
+    def resolve(self, name: str, fuzzy: bool = True) -> Optional[str]:
+        """Возвращает каноническое имя или None, если псевдоним не найден"""
+
+        canonical = self._exact.get(name.lower())
+        if canonical is not None:
+            return canonical
+
+        normalized = normalize_text(name)
+        canonical = self._normalized.get(normalized)
+        if canonical is not None or not fuzzy or not normalized:
+            return canonical
+
+        return self._fuzzy_lookup(normalized)
@@ -0,0 +1,157 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional
+from backend.utils.concurrency import run_blocking
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш в памяти с вытеснением LRU и опциональным TTL"""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, created_at = item
+            if self.ttl is not None and time.time() - created_at > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(
+        self, key: Hashable, value: Any, created_at: Optional[float] = None
+    ) -> None:
+        with self._lock:
+            self._data[key] = (value, created_at or time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStore:
+    """Простое key-value хранилище на диске поверх SQLite"""
+
+    def __init__(self, path: str, table: str = "cache"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def get_many(
+        self, keys: List[str], max_age: Optional[float] = None
+    ) -> Dict[str, tuple[bytes, float]]:
+        """Значения и время записи для найденных ключей"""
+        if not keys:
+            return {}
+        min_created_at = time.time() - max_age if max_age is not None else 0.0
+        result = {}
+        with self._lock:
+            # ограничение SQLite на количество параметров в запросе
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, value, created_at FROM {self.table} "
+                    f"WHERE key IN ({placeholders}) AND created_at >= ?",
+                    (*chunk, min_created_at),
+                )
+                result.update(
+                    {key: (value, created_at) for key, value, created_at in rows}
+                )
+        return result
+
+    def set_many(self, items: Dict[str, bytes]) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at) "
+                "VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()],
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(f"DELETE FROM {self.table}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class JSONCache:
+    """
+    Двухуровневый кэш JSON-значений: LRU в памяти и опционально SQLite на диске.
+    TTL действует на оба уровня.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+        table: str = "cache",
+    ):
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+        self.disk = SQLiteStore(path, table) if path else None
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+
+        item = self.disk.get_many([key], max_age=self.ttl).get(key)
+        if item is None:
+            return None
+        raw, created_at = item
+        value = json.loads(raw)
+        self.memory.set(key, value, created_at)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set_many(
+                {key: json.dumps(value, ensure_ascii=False).encode("utf-8")}
+            )
+
+    async def aget(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        return await run_blocking(self.get, key)
+
+    async def aset(self, key: str, value: Any) -> None:
+        if self.disk is None:
+            self.set(key, value)
+        else:
+            await run_blocking(self.set, key, value)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
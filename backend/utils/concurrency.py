@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+from backend.utils.config_loader import config
+from backend.utils.metrics import (
+    coalesced_requests,
+    llm_queue_seconds,
+    rejected_requests,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.server.blocking_threads, thread_name_prefix="blocking"
+        )
+    return _executor
+
+
+async def run_blocking(func: Callable[..., T], *args: Any) -> T:
+    """
+    Выполнение блокирующей функции (SQLite, вычисления NumPy) в ограниченном
+    пуле потоков, не занимая цикл событий
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await loop.run_in_executor(_get_executor(), call)
+
+
+class Overloaded(Exception):
+    """Сервер перегружен: очередь запросов заполнена или ожидание слишком долгое"""
+
+
+class AdmissionController:
+    """
+    Ограничение числа одновременно обрабатываемых запросов. Запросы сверх
+    лимита ждут в очереди глубиной не более max_queue и не дольше
+    queue_timeout, иначе отклоняются с Overloaded.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+
+    async def acquire(self) -> None:
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        if self.waiting >= self.max_queue:
+            rejected_requests.inc(reason="queue_full")
+            raise Overloaded("Очередь запросов заполнена")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            rejected_requests.inc(reason="queue_timeout")
+            raise Overloaded("Превышено время ожидания в очереди запросов")
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых параллельных вызовов: пока задача с ключом
+    выполняется, остальные вызывающие ждут ее результат, а не запускают свою.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            coalesced_requests.inc()
+            logger.info("Запрос объединен с уже выполняющимся")
+
+        # shield: отмена одного вызывающего не отменяет общую задачу
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+PRIORITIES = {"interactive": 0, "evaluation": 1, "ingestion": 2}
+
+_llm_priority: ContextVar[str] = ContextVar("llm_priority", default="interactive")
+
+
+@contextmanager
+def llm_priority(name: str) -> Iterator[None]:
+    """Класс приоритета для всех вызовов LLM внутри блока (и созданных в нем задач)"""
+    if name not in PRIORITIES:
+        raise ValueError(f"Неизвестный приоритет: {name}")
+    token = _llm_priority.set(name)
+    try:
+        yield
+    finally:
+        _llm_priority.reset(token)
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления токена"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class LLMScheduler:
+    """
+    Планировщик вызовов LLM: общий лимит одновременных запросов, token bucket
+    на провайдера и очередь по классам приоритета. Фоновым классам
+    (оценка, построение графа) недоступны слоты, зарезервированные
+    под интерактивные запросы.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        reserved_interactive: int,
+        rate_limits: Dict[str, float],
+        burst: float,
+    ):
+        self.max_concurrency = max_concurrency
+        self.background_limit = max(1, max_concurrency - reserved_interactive)
+        self.buckets = {
+            provider: TokenBucket(rate, burst) for provider, rate in rate_limits.items()
+        }
+        self._active = 0
+        self._background = 0
+        self._waiters: list = []
+        self._counter = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _has_slot(self, priority: int) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        return priority == 0 or self._background < self.background_limit
+
+    def _dispatch(self) -> None:
+        """Выдача слотов ожидающим в порядке приоритета"""
+        while self._waiters:
+            priority, _, provider, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            # в голове очереди самый приоритетный: если ему слота нет, нет и остальным
+            if not self._has_slot(priority):
+                return
+            bucket = self.buckets.get(provider)
+            if bucket is not None:
+                delay = bucket.delay()
+                if delay > 0:
+                    if self._timer is None:
+                        self._timer = self._loop.call_later(delay, self._wake)
+                    return
+                bucket.take()
+            heapq.heappop(self._waiters)
+            self._active += 1
+            if priority > 0:
+                self._background += 1
+            future.set_result(None)
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _release(self, priority: int) -> None:
+        self._active -= 1
+        if priority > 0:
+            self._background -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, provider: str) -> AsyncIterator[None]:
+        """Ожидание слота для вызова LLM с приоритетом текущего контекста"""
+        name = _llm_priority.get()
+        priority = PRIORITIES[name]
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # таймер и ожидающие от предыдущего цикла событий (asyncio.run) не нужны
+            self._loop = loop
+            self._timer = None
+            self._waiters = []
+            self._active = self._background = 0
+
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), provider, future))
+        start = time.perf_counter()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(priority)
+            raise
+        llm_queue_seconds.observe(time.perf_counter() - start, priority=name)
+
+        try:
+            yield
+        finally:
+            self._release(priority)
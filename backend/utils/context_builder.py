@@ -0,0 +1,124 @@
+import math
+import logging
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+class ContextBuilder:
+    """
+    Сборка контекста для ответа: отбор связей методом MMR (релевантность
+    минус сходство с уже выбранными) без почти-дубликатов и упаковка
+    в заданный бюджет токенов. Токены считаются кодировкой tiktoken
+    (пакет приходит с langchain-openai), а если она не задана или не
+    загрузилась - оценкой по chars_per_token.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        history_tokens: int,
+        mmr_lambda: float,
+        duplicate_threshold: float,
+        chars_per_token: float,
+        tokenizer: Optional[str] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.history_tokens = history_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.chars_per_token = chars_per_token
+        self.encoding = None
+        if tokenizer:
+            try:
+                import tiktoken
+
+                self.encoding = tiktoken.get_encoding(tokenizer)
+            except Exception as e:
+                logger.warning(
+                    f"Токенизатор {tokenizer} недоступен ({e}), "
+                    f"токены оцениваются по длине текста"
+                )
+
+    def count_tokens(self, text: str) -> int:
+        """Количество токенов (оценка по длине текста без токенизатора)"""
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return math.ceil(len(text) / self.chars_per_token)
+
+    @staticmethod
+    def _render(number: int, document: Document) -> str:
+        """Строка документа в контексте"""
+        return "-" * 40 + f"\n{number}. {document.page_content}"
+
+    def format_history(self, chat_history: Optional[List[Dict[str, str]]]) -> str:
+        """Последние сообщения истории чата, помещающиеся в бюджет токенов"""
+        lines = []
+        budget = self.history_tokens
+        for msg in reversed(chat_history or []):
+            line = f"{msg['role']}: {msg['content']}"
+            tokens = self.count_tokens(line)
+            if tokens > budget:
+                break
+            lines.append(line)
+            budget -= tokens
+        return "\n".join(reversed(lines))
+
+    def _mmr_order(self, documents: List[Document]) -> List[int]:
+        """Порядок документов по MMR, почти-дубликаты выбранных отбрасываются"""
+
+        vectors = [doc.metadata.get("embedding") for doc in documents]
+        dim = next((len(vector) for vector in vectors if vector is not None), 0)
+        if dim == 0:
+            return list(range(len(documents)))
+
+        matrix = np.zeros((len(documents), dim), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            if vector is not None and len(vector) == dim:
+                matrix[i] = vector
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=matrix, where=norms > 0)
+        similarity = matrix @ matrix.T
+
+        relevance = np.array(
+            [doc.metadata.get("similarity") or 0.0 for doc in documents],
+            dtype=np.float32,
+        )
+        max_similarity = np.zeros(len(documents), dtype=np.float32)
+        available = np.ones(len(documents), dtype=bool)
+        order = []
+        while available.any():
+            scores = (
+                self.mmr_lambda * relevance - (1 - self.mmr_lambda) * max_similarity
+            )
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            order.append(best)
+            available[best] = False
+            max_similarity = np.maximum(max_similarity, similarity[best])
+            available &= max_similarity < self.duplicate_threshold
+
+        return order
+
+    def build(
+        self, documents: List[Document], reserved_tokens: int = 0
+    ) -> Tuple[str, List[int]]:
+        """
+        Контекст из документов, помещающихся в бюджет (за вычетом уже занятых
+        токенов), и индексы использованных документов.
+        """
+
+        budget = self.max_tokens - reserved_tokens
+        selected = []
+        lines = []
+        for index in self._mmr_order(documents):
+            line = self._render(len(selected) + 1, documents[index])
+            tokens = self.count_tokens(line)
+            if tokens <= budget:
+                selected.append(index)
+                lines.append(line)
+                budget -= tokens
+
+        return "".join(lines), selected
@@ -0,0 +1,174 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+from backend.utils.concurrency import run_blocking
+
+
+class Conversation:
+    """Последние сообщения одной сессии в кольцевом буфере"""
+
+    def __init__(self, max_messages: int, next_id: int = 1):
+        self.messages: Deque[Dict] = deque(maxlen=max_messages)
+        self.next_id = next_id
+        self.last_seen = time.time()
+
+
+class ConversationStore:
+    """
+    Хранилище диалогов по сессиям: в памяти по max_messages последних сообщений
+    на сессию, сессии без активности дольше idle_ttl (и сверх max_sessions)
+    вытесняются. С path сообщения дублируются в SQLite, и вытесненная сессия
+    восстанавливается при следующем обращении; на диске сессия хранится
+    retention секунд после последнего сообщения.
+    """
+
+    def __init__(
+        self,
+        max_messages: int,
+        max_sessions: int,
+        idle_ttl: float,
+        greeting: str,
+        path: Optional[str] = None,
+        retention: Optional[float] = None,
+    ):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.greeting = greeting
+        self.retention = retention
+        self._last_cleanup = 0.0
+        self._sessions: OrderedDict[str, Conversation] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS messages "
+                    "(session_id TEXT NOT NULL, id INTEGER NOT NULL, role TEXT NOT NULL, "
+                    "content TEXT NOT NULL, created_at REAL NOT NULL, "
+                    "PRIMARY KEY (session_id, id))"
+                )
+
+    def _evict(self, now: float) -> None:
+        """Вытеснение простаивающих сессий и сессий сверх лимита"""
+        while self._sessions:
+            session_id, conversation = next(iter(self._sessions.items()))
+            if (
+                len(self._sessions) < self.max_sessions
+                and now - conversation.last_seen <= self.idle_ttl
+            ):
+                break
+            del self._sessions[session_id]
+
+        if (
+            self._connection is not None
+            and self.retention is not None
+            and now - self._last_cleanup > self.idle_ttl
+        ):
+            self._last_cleanup = now
+            with self._connection:
+                self._connection.execute(
+                    "DELETE FROM messages WHERE session_id IN ("
+                    "SELECT session_id FROM messages GROUP BY session_id "
+                    "HAVING MAX(created_at) < ?)",
+                    (now - self.retention,),
+                )
+
+    def _load(self, session_id: str) -> Conversation:
+        conversation = Conversation(self.max_messages)
+        if self._connection is not None:
+            rows = self._connection.execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, self.max_messages),
+            ).fetchall()
+            for id, role, content in reversed(rows):
+                conversation.messages.append(
+                    {"id": id, "role": role, "content": content}
+                )
+            if rows:
+                conversation.next_id = rows[0][0] + 1
+        return conversation
+
+    def _session(self, session_id: str) -> Conversation:
+        now = time.time()
+        conversation = self._sessions.get(session_id)
+        if conversation is None:
+            self._evict(now)
+            conversation = self._load(session_id)
+            self._sessions[session_id] = conversation
+            if not conversation.messages:
+                self._append(session_id, conversation, "assistant", self.greeting)
+        conversation.last_seen = now
+        self._sessions.move_to_end(session_id)
+        return conversation
+
+    def _append(
+        self, session_id: str, conversation: Conversation, role: str, content: str
+    ) -> Dict:
+        message = {"id": conversation.next_id, "role": role, "content": content}
+        conversation.next_id += 1
+        conversation.messages.append(message)
+        if self._connection is not None:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT INTO messages (session_id, id, role, content, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (session_id, message["id"], role, content, time.time()),
+                )
+                self._connection.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id <= ?",
+                    (session_id, message["id"] - self.max_messages),
+                )
+        return message
+
+    def append(self, session_id: str, role: str, content: str) -> Dict:
+        """Добавление сообщения, возвращает его с присвоенным id"""
+        with self._lock:
+            conversation = self._session(session_id)
+            return self._append(session_id, conversation, role, content)
+
+    def messages(self, session_id: str, after_id: int = 0) -> List[Dict]:
+        """Сообщения сессии с id больше after_id"""
+        with self._lock:
+            conversation = self._session(session_id)
+            return [msg for msg in conversation.messages if msg["id"] > after_id]
+
+    def history(self, session_id: str, limit: int) -> List[Dict[str, str]]:
+        """Последние limit сообщений сессии для истории чата"""
+        with self._lock:
+            conversation = self._session(session_id)
+            return [
+                {"role": msg["role"], "content": msg["content"]}
+                for msg in list(conversation.messages)[-limit:]
+            ]
+
+    async def aappend(self, session_id: str, role: str, content: str) -> Dict:
+        if self._connection is None:
+            return self.append(session_id, role, content)
+        return await run_blocking(self.append, session_id, role, content)
+
+    async def amessages(self, session_id: str, after_id: int = 0) -> List[Dict]:
+        if self._connection is None:
+            return self.messages(session_id, after_id)
+        return await run_blocking(self.messages, session_id, after_id)
+
+    async def ahistory(self, session_id: str, limit: int) -> List[Dict[str, str]]:
+        if self._connection is None:
+            return self.history(session_id, limit)
+        return await run_blocking(self.history, session_id, limit)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -4,12 +4,18 @@ from pathlib import Path
 class CypherLoader:
     def __init__(self, base_path: str = "cypher"):
         self.base_path = Path(base_path)
+        self._queries: dict[str, str] = {}
 
     def load(self, name: str) -> str:
         """
         Загружает запрос из cypher/{name}.cypher
         Пример: loader.load("find_entities") → содержимое find_entities.cypher
+        Файл читается один раз, дальше запрос берется из памяти.
         """
+        query = self._queries.get(name)
+        if query is not None:
+            return query
+
         path = self.base_path / f"{name}.cypher"
         if not path.exists():
             raise FileNotFoundError(f"Cypher query '{name}' not found at {path}")
@@ -17,4 +23,5 @@ class CypherLoader:
         with open(path, "r", encoding="utf-8") as f:
             query = f.read().strip()
 
+        self._queries[name] = query
         return query
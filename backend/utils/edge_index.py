@@ -0,0 +1,187 @@
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+START_LABELS = ("персонаж", "место", "предмет", "организация")
+
+
+def _present(vector: Optional[List[float]], dim: int) -> bool:
+    return bool(vector) and len(vector) == dim
+
+
+def _unit(vector: Optional[List[float]], dim: int) -> np.ndarray:
+    """Нормированный вектор (нулевой, если эмбеддинг отсутствует)"""
+    if not _present(vector, dim):
+        return np.zeros(dim, dtype=np.float32)
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm > 0 else array
+
+
+class EdgeIndex:
+    """
+    Эмбеддинги связей в памяти для ранжирования без Cypher.
+    Строки матрицы сгруппированы по стартовой вершине: связи каждой вершины
+    занимают непрерывный блок [begin, end), а в строке хранятся склеенные
+    нормированные векторы [desc_embedding | rel_embedding], а в present -
+    признаки наличия этих эмбеддингов.
+    """
+
+    def __init__(
+        self,
+        rows: List[Dict[str, Any]],
+        vectors: np.ndarray,
+        present: np.ndarray,
+        offsets: Dict[str, Tuple[int, int]],
+    ):
+        self.rows = rows
+        self.vectors = vectors
+        self.present = present
+        self.offsets = offsets
+        self.dim = vectors.shape[1] // 2
+
+    @classmethod
+    def from_graph_data(
+        cls,
+        node_data: List[Dict[str, Any]],
+        edge_data: List[Dict[str, Any]],
+        start_labels: Iterable[str] = START_LABELS,
+    ) -> "EdgeIndex":
+        """Построение индекса из данных, подготовленных GrpahLoader для загрузки в граф"""
+
+        start_labels = set(start_labels)
+        labels = {node["properties"]["name"]: node["label"] for node in node_data}
+        descriptions = {
+            node["properties"]["name"]: node["properties"].get("description", "")
+            for node in node_data
+        }
+
+        # в графе одна связь на ключ (концы, тип, глава, описание)
+        edges = {}
+        for edge in edge_data:
+            if edge["src_name"] in labels and edge["tgt_name"] in labels:
+                edges[edge["key"]] = edge
+
+        dim = next(
+            (
+                len(vector)
+                for edge in edges.values()
+                for vector in (edge.get("desc_embedding"), edge.get("rel_embedding"))
+                if vector
+            ),
+            0,
+        )
+
+        incidences = defaultdict(list)
+        for edge in edges.values():
+            if not edge.get("rel_embedding") and not edge.get("desc_embedding"):
+                continue
+            src, tgt = edge["src_name"], edge["tgt_name"]
+            for start, target in ((src, tgt), (tgt, src)):
+                if labels[start] in start_labels:
+                    incidences[start].append((edge, target))
+
+        size = sum(len(items) for items in incidences.values())
+        vectors = np.zeros((size, 2 * dim), dtype=np.float32)
+        present = np.zeros((size, 2), dtype=bool)
+        rows = []
+        offsets = {}
+        for start, items in incidences.items():
+            begin = len(rows)
+            for edge, target in items:
+                vectors[len(rows), :dim] = _unit(edge.get("desc_embedding"), dim)
+                vectors[len(rows), dim:] = _unit(edge.get("rel_embedding"), dim)
+                present[len(rows)] = (
+                    _present(edge.get("desc_embedding"), dim),
+                    _present(edge.get("rel_embedding"), dim),
+                )
+                rows.append(
+                    {
+                        "source": start,
+                        "rel_type": edge["rel_type"],
+                        "rel_desc": edge.get("description", ""),
+                        "target": target,
+                        "tgt_desc": descriptions[target],
+                        "source_type": labels[start],
+                        "target_type": labels[target],
+                        "chapter": edge.get("chapter"),
+                    }
+                )
+            offsets[start] = (begin, len(rows))
+
+        logger.info(
+            f"Индекс связей построен: {len(rows)} строк, {len(offsets)} вершин, dim={dim}"
+        )
+        return cls(rows, vectors, present, offsets)
+
+    def search(
+        self,
+        entities: List[str],
+        edge_embeddings: List[List[float]],
+        query_embedding: Optional[List[float]],
+        limit: int = 10,
+    ) -> List[Dict[str, Any]]:
+        """
+        Ранжирование связей вокруг сущностей: 0.5 * sim(описание, запрос) +
+        0.5 * max sim(тип связи, предикат) — одним матричным умножением.
+        Сходство считается как vector.similarity.cosine в retrieve.cypher:
+        (1 + cos) / 2, а при отсутствии любого из векторов - 0.
+        """
+
+        blocks = [
+            self.offsets[entity]
+            for entity in dict.fromkeys(entities)
+            if entity in self.offsets
+        ]
+        if not blocks or self.dim == 0:
+            return []
+
+        if len(blocks) == 1:
+            index = slice(*blocks[0])
+        else:
+            index = np.concatenate([np.arange(begin, end) for begin, end in blocks])
+        candidates = self.vectors[index]
+        present = self.present[index]
+
+        # столбец 0 — [запрос | 0], остальные столбцы — [0 | предикат]
+        queries = np.zeros((2 * self.dim, 1 + len(edge_embeddings)), dtype=np.float32)
+        queries_present = np.zeros(1 + len(edge_embeddings), dtype=bool)
+        queries[: self.dim, 0] = _unit(query_embedding, self.dim)
+        queries_present[0] = _present(query_embedding, self.dim)
+        for i, embedding in enumerate(edge_embeddings, start=1):
+            queries[self.dim :, i] = _unit(embedding, self.dim)
+            queries_present[i] = _present(embedding, self.dim)
+
+        mask = np.empty((len(candidates), len(queries_present)), dtype=bool)
+        mask[:, 0] = present[:, 0] & queries_present[0]
+        mask[:, 1:] = present[:, 1:2] & queries_present[1:]
+        similarities = np.where(mask, (1 + candidates @ queries) / 2, 0.0)
+        desc_similarity = similarities[:, 0]
+        rel_similarity = (
+            similarities[:, 1:].max(axis=1)
+            if edge_embeddings
+            else np.zeros_like(desc_similarity)
+        )
+        combined = 0.5 * desc_similarity + 0.5 * rel_similarity
+
+        if len(combined) > limit:
+            top = np.argpartition(-combined, limit)[:limit]
+        else:
+            top = np.arange(len(combined))
+        top = top[np.argsort(-combined[top], kind="stable")]
+
+        positions = (
+            np.arange(*blocks[0])[top] if isinstance(index, slice) else index[top]
+        )
+        return [
+            {
+                **self.rows[position],
+                "similarity": float(combined[i]),
+                "desc_similarity": float(desc_similarity[i]),
+                "desc_embedding": self.vectors[position, : self.dim],
+            }
+            for position, i in zip(positions, top)
+        ]
@@ -0,0 +1,183 @@
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Tuple
+
+# окончания для простого стемминга русских слов (от длинных к коротким)
+ENDINGS = sorted(
+    [
+        "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ой", "ей",
+        "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ую", "юю", "ая",
+        "яя", "ое", "ее", "ые", "ие", "ый", "ий", "а", "я", "о", "е", "ы",
+        "и", "у", "ю", "ь",
+    ],
+    key=len,
+    reverse=True,
+)  # fmt: skip
+
+STOPWORDS = {
+    "кто", "что", "кого", "чего", "кому", "чему", "кем", "чем", "ком", "чём",
+    "как", "какой", "какая", "какое", "какие", "каким", "какого", "какую",
+    "где", "куда", "откуда", "когда", "почему", "зачем", "сколько", "чей",
+    "чья", "чьё", "чье", "чьи", "ли", "же", "бы", "не", "ни", "и", "а", "но",
+    "или", "в", "во", "на", "с", "со", "к", "ко", "о", "об", "обо", "от",
+    "до", "из", "у", "за", "по", "про", "для", "при", "над", "под", "это",
+    "этот", "эта", "тот", "та", "то", "он", "она", "оно", "они", "его", "ее",
+    "её", "их", "ему", "ей", "им", "был", "была", "было", "были", "быть",
+    "такой", "такая", "такое", "ли", "между", "друг", "другу", "друга",
+}  # fmt: skip
+
+_TOKEN = re.compile(r"[a-zа-я0-9]+")
+# те же слова, что и у _TOKEN, но в исходном регистре
+_WORD = re.compile(r"[a-zа-яё0-9]+", re.IGNORECASE)
+
+# уверенность: совпадение словоформ и совпадение только по основе
+EXACT_CONFIDENCE = 1.0
+STEM_CONFIDENCE = 0.9
+# штраф за слово с заглавной буквы не в начале предложения, не найденное
+# в словаре (вероятно, неизвестное имя)
+UNKNOWN_NAME_PENALTY = 0.3
+# штраф за каждое ненайденное значимое слово сверх EXPECTED_PREDICATES
+EXTRA_WORD_PENALTY = 0.1
+EXPECTED_PREDICATES = 2
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower().replace("ё", "е"))
+
+
+def _words(text: str) -> Tuple[List[str], List[bool]]:
+    """Слова как в tokenize и признаки заглавной буквы не в начале предложения"""
+    tokens = []
+    capitalized = []
+    for match in _WORD.finditer(text):
+        word = match.group()
+        tokens.append(word.lower().replace("ё", "е"))
+        before = text[: match.start()].rstrip()
+        sentence_start = not before or before[-1] in ".!?…"
+        capitalized.append(word[0].isupper() and not sentence_start)
+    return tokens, capitalized
+
+
+def stem(token: str) -> str:
+    """Простой стемминг: отбрасывание падежного окончания, основа не короче 3 букв"""
+    for ending in ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[: -len(ending)]
+    return token
+
+
+@dataclass
+class EntityMatch:
+    entities: List[str] = field(default_factory=list)
+    predicates: List[str] = field(default_factory=list)
+    confidence: float = 0.0
+
+
+class EntityMatcher:
+    """
+    Поиск известных сущностей в вопросе без LLM: автомат Ахо — Корасик по
+    основам слов всех имен вершин и их псевдонимов.
+    """
+
+    def __init__(self, names: Iterable[Tuple[str, str]]):
+        """names — пары (имя или псевдоним, каноническое имя)"""
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # для каждого состояния: (длина шаблона в словах, каноническое имя, сам шаблон)
+        self._output: List[List[Tuple[int, str, Tuple[str, ...]]]] = [[]]
+
+        for name, canonical in names:
+            tokens = tuple(tokenize(name))
+            if tokens:
+                self._add(tuple(stem(token) for token in tokens), canonical, tokens)
+        self._build()
+
+    def _add(self, stems: Tuple[str, ...], canonical: str, tokens: Tuple[str, ...]):
+        state = 0
+        for item in stems:
+            if item not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][item] = len(self._goto) - 1
+            state = self._goto[state][item]
+        if all(output[1] != canonical for output in self._output[state]):
+            self._output[state].append((len(stems), canonical, tokens))
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for item, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and item not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(item, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = (
+                    self._output[child] + self._output[self._fail[child]]
+                )
+
+    def extract(self, text: str) -> EntityMatch:
+        """
+        Сущности (самые длинные непересекающиеся совпадения) и остальные слова
+        как предикаты. Уверенность снижается за совпадения только по основе,
+        за ненайденные слова с заглавной буквы и за лишние ненайденные слова.
+        """
+
+        tokens, capitalized = _words(text)
+        stems = [stem(token) for token in tokens]
+
+        matches = []
+        state = 0
+        for end, item in enumerate(stems, start=1):
+            while state and item not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(item, 0)
+            for length, canonical, pattern in self._output[state]:
+                matches.append((end - length, end, canonical, pattern))
+
+        # предпочитаем более длинные совпадения, затем более ранние
+        matches.sort(key=lambda match: (-(match[1] - match[0]), match[0]))
+        covered = [False] * len(tokens)
+        entities = []
+        confidences = []
+        for start, end, canonical, pattern in matches:
+            if any(covered[start:end]):
+                continue
+            if end - start == 1 and tokens[start] in STOPWORDS:
+                continue
+            covered[start:end] = [True] * (end - start)
+            if canonical not in entities:
+                entities.append(canonical)
+            # совпадение словоформ надежнее совпадения только по основе
+            exact = tuple(tokens[start:end]) == pattern
+            confidences.append(EXACT_CONFIDENCE if exact else STEM_CONFIDENCE)
+
+        predicates = [
+            token
+            for token, is_covered in zip(tokens, covered)
+            if not is_covered and token not in STOPWORDS and len(token) > 2
+        ]
+        unknown_names = sum(
+            1
+            for token, is_covered, is_capitalized in zip(tokens, covered, capitalized)
+            if not is_covered and is_capitalized and token not in STOPWORDS
+        )
+
+        confidence = 0.0
+        if confidences:
+            confidence = (
+                min(confidences)
+                - UNKNOWN_NAME_PENALTY * unknown_names
+                - EXTRA_WORD_PENALTY * max(0, len(predicates) - EXPECTED_PREDICATES)
+            )
+
+        return EntityMatch(
+            entities=entities,
+            predicates=predicates,
+            confidence=round(max(confidence, 0.0), 2),
+        )
@@ -0,0 +1,87 @@
+import json
+import hashlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+
+def content_hash(value: Any) -> str:
+    """sha256 JSON-представления значения (ключи отсортированы)"""
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def edge_key(
+    src_name: str, rel_type: str, tgt_name: str, chapter: Any, description: str
+) -> str:
+    """Идентификатор связи: концы, тип, глава и хэш описания"""
+    desc_hash = hashlib.sha256(description.encode("utf-8")).hexdigest()
+    return content_hash([src_name, rel_type, tgt_name, chapter, desc_hash])
+
+
+@dataclass
+class GraphDiff:
+    """Изменения, которые нужно применить к графу, чтобы он совпал с данными"""
+
+    create_nodes: List[Dict[str, Any]] = field(default_factory=list)
+    update_nodes: List[Dict[str, Any]] = field(default_factory=list)
+    delete_nodes: List[str] = field(default_factory=list)
+    create_edges: List[Dict[str, Any]] = field(default_factory=list)
+    update_edges: List[Dict[str, Any]] = field(default_factory=list)
+    delete_edges: List[Dict[str, str]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return (
+            len(self.create_nodes)
+            + len(self.update_nodes)
+            + len(self.delete_nodes)
+            + len(self.create_edges)
+            + len(self.update_edges)
+            + len(self.delete_edges)
+        )
+
+    def summary(self) -> str:
+        return (
+            f"вершины +{len(self.create_nodes)} ~{len(self.update_nodes)} "
+            f"-{len(self.delete_nodes)}, связи +{len(self.create_edges)} "
+            f"~{len(self.update_edges)} -{len(self.delete_edges)}"
+        )
+
+
+def diff_graph(
+    nodes: List[Dict[str, Any]],
+    edges: List[Dict[str, Any]],
+    existing_nodes: Dict[str, str],
+    existing_edges: Dict[str, Dict[str, str]],
+) -> GraphDiff:
+    """
+    Сравнение новых вершин и связей (в формате GrpahLoader, с полями hash и key)
+    с тем, что уже есть в графе.
+    existing_nodes: имя -> hash, existing_edges: key -> {src_name, tgt_name, hash}
+    """
+    diff = GraphDiff()
+
+    names = set()
+    for node in nodes:
+        name = node["properties"]["name"]
+        names.add(name)
+        if name not in existing_nodes:
+            diff.create_nodes.append(node)
+        elif existing_nodes[name] != node["properties"]["hash"]:
+            diff.update_nodes.append(node)
+    diff.delete_nodes = [name for name in existing_nodes if name not in names]
+
+    keys = set()
+    for edge in edges:
+        keys.add(edge["key"])
+        existing = existing_edges.get(edge["key"])
+        if existing is None:
+            diff.create_edges.append(edge)
+        elif existing["hash"] != edge["hash"]:
+            diff.update_edges.append(edge)
+    diff.delete_edges = [
+        {"key": key, "src_name": edge["src_name"], "tgt_name": edge["tgt_name"]}
+        for key, edge in existing_edges.items()
+        if key not in keys
+    ]
+
+    return diff
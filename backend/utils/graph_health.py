@@ -0,0 +1,75 @@
+import time
+import asyncio
+import logging
+from typing import Optional
+from neo4j.exceptions import DriverError, Neo4jError
+from backend.utils.cypher_loader import CypherLoader
+from backend.utils.neo4j_client import Neo4jClient
+from backend.utils.metrics import cache_hits, cache_misses
+
+logger = logging.getLogger(__name__)
+
+
+class GraphHealth:
+    """Кэшированное состояние доступности графа с фоновым обновлением"""
+
+    def __init__(
+        self, neo4j_client: Neo4jClient, cypher_loader: CypherLoader, ttl: float
+    ):
+        self.neo4j_client = neo4j_client
+        self.cypher_loader = cypher_loader
+        self.ttl = ttl
+        self.available: Optional[bool] = None
+        self.checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def invalidate(self) -> None:
+        """Сброс состояния (например, после перезагрузки графа)"""
+        self.available = None
+        self.checked_at = 0.0
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self.checked_at > self.ttl
+
+    async def refresh(self) -> bool:
+        """Проверяет, доступен ли граф и содержит ли он данные с правильными метками"""
+        async with self._lock:
+            try:
+                records = await self.neo4j_client.execute_query(
+                    self.cypher_loader.load("check")
+                )
+                node_count = records[0]["count"] if records else 0
+                self.available = node_count > 0
+                if not self.available:
+                    logger.info(
+                        "Граф доступен, но не содержит данных с нужными метками."
+                    )
+            except (DriverError, Neo4jError) as e:
+                logger.warning(f"Граф недоступен: {e}")
+                self.available = False
+            except Exception as e:
+                logger.warning(f"Не удалось проверить состояние графа: {e}")
+                if self.available is None:
+                    raise
+            self.checked_at = time.monotonic()
+            return self.available
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def is_available(self) -> bool:
+        """Возвращает закэшированное состояние, обновляя его в фоне по истечении TTL"""
+        if self.available is None:
+            cache_misses.inc(cache="graph_health")
+            return await self.refresh()
+        cache_hits.inc(cache="graph_health")
+        if self._is_stale():
+            self._schedule_refresh()
+        return self.available
+
+    async def close(self) -> None:
+        """Отмена фоновой проверки"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
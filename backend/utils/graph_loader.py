@@ -1,14 +1,32 @@
 import re
 import os
 import json
-from typing import List, Dict, Any, Tuple
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Awaitable, List, Dict, Any, Optional, Tuple
 from pathlib import Path
-from backend.utils.llm import LLMWorker
+from backend.utils.llm import LLMWorker, get_bulk_embedder
 from backend.utils.cypher_loader import CypherLoader
 from backend.utils.text_extractor import TextExtractor
+from backend.utils.alias_resolver import AliasResolver
+from backend.utils.graph_diff import GraphDiff, content_hash, diff_graph, edge_key
+from backend.utils.metrics import ingest_rows, timed
+from backend.utils.concurrency import llm_priority
 from backend.utils.config_loader import config
+from tqdm import tqdm
 from tqdm.asyncio import tqdm_asyncio
 from neo4j import GraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+
+logger = logging.getLogger(__name__)
+
+# версия формата загрузки (свойства вершин и связей, схема, cypher загрузки);
+# увеличивается при их изменении, чтобы отпечаток не совпал со старым графом
+LOADER_VERSION = 1
 
 
 class GrpahLoader:
@@ -17,50 +35,161 @@ class GrpahLoader:
         path2data: str = "./backend//data/structed_text",
         path2kg: str = "./backend/data/entities_and_relations",
         path2summary: str = "./backend/data/chapter_sumamries.json",
+        path2checkpoints: str = "./backend/data/checkpoints",
+        alias_resolver: Optional[AliasResolver] = None,
     ):
         self.reg_expression = r"[^a-zA-Zа-яА-ЯёЁ0-9]"
         self.llm = LLMWorker(config)
         self.path2data = Path(path2data)
         self.path2kg = Path(path2kg)
         self.path2summary = Path(path2summary)
+        self.path2checkpoints = Path(path2checkpoints)
         self.extractor = TextExtractor()
         self.cypher_loader = CypherLoader()
+        self._alias_resolver = alias_resolver
+        self.graph_version = ""
 
         self.neo4j_uri: str = os.environ.get("NEO4J_URI", "bolt://neo4j-db:7687")
         self.neo4j_username: str = os.environ.get("NEO4J_USERNAME", "neo4j")
         self.neo4j_password: str = os.environ.get("NEO4J_PASSWORD", "password123")
 
+    @property
+    def alias_resolver(self) -> AliasResolver:
+        """Индекс псевдонимов, строится один раз при первом обращении"""
+        if self._alias_resolver is None:
+            self._alias_resolver = AliasResolver.from_file(
+                config.aliases.path, config.aliases.min_similarity
+            )
+        return self._alias_resolver
+
+    @staticmethod
+    def _write_json(path: Path, data: Any) -> None:
+        """Атомарная запись JSON: файл либо целиком новый, либо прежний"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data, indent=4, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @staticmethod
+    async def _settle(task: Awaitable[Any]) -> Any:
+        """Результат задачи или исключение: сбой одной задачи не прерывает остальные"""
+        try:
+            return await task
+        except Exception as e:
+            logger.error(f"Ошибка при обработке главы: {e}")
+            return e
+
+    @staticmethod
+    def _raise_failed(results: List[Any], stage: str) -> None:
+        failed = [result for result in results if isinstance(result, Exception)]
+        if failed:
+            raise RuntimeError(
+                f"{stage}: не обработано {len(failed)} из {len(results)}, "
+                "повторный запуск продолжит с контрольных точек"
+            ) from failed[0]
+
+    async def _extract_chunk(self, chunk: str, checkpoint: Path) -> Dict[str, Any]:
+        """Извлечение вершин и связей из окна главы с контрольной точкой"""
+        if checkpoint.exists():
+            return json.loads(checkpoint.read_text(encoding="utf-8"))
+
+        entities_and_realations = await self.llm.get_entities_and_relations(chunk)
+        result = entities_and_realations.model_dump()
+        self._write_json(checkpoint, result)
+        return result
+
+    @staticmethod
+    def _merge_extractions(results: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+        """Объединение извлечений из перекрывающихся окон одной главы"""
+
+        entities = {}
+        relationships = {}
+        for result in results:
+            for entity in result["entities"]:
+                key = (entity["name"].lower(), entity["entity_type"])
+                known = entities.get(key)
+                if known is None or len(entity["description"]) > len(
+                    known["description"]
+                ):
+                    entities[key] = entity
+            for rel in result["relationships"]:
+                key = (
+                    rel["entity_1"].lower(),
+                    rel["entity_2"].lower(),
+                    rel["relationship_type"],
+                )
+                known = relationships.get(key)
+                if known is None or len(rel["description"]) > len(known["description"]):
+                    relationships[key] = rel
+
+        return {
+            "entities": list(entities.values()),
+            "relationships": list(relationships.values()),
+        }
+
     async def _process_extract_nodes_and_edges(
         self, path2json: Path, chapter: Path
     ) -> None:
-        """Вспомогательная функция для извлчение вершин и связей"""
+        """
+        Вспомогательная функция для извлчение вершин и связей.
+        Длинная глава делится на перекрывающиеся окна, каждое окно сохраняется
+        в контрольную точку, глава записывается после обработки всех окон.
+        """
 
         chapter_content = chapter.read_text(encoding="utf-8")
-        entities_and_realations = await self.llm.get_entities_and_relations(
-            chapter_content
+        chars_per_token = config.ingest.chars_per_token
+        chunks = self.extractor.split(
+            chapter_content,
+            int(config.ingest.chunk_tokens * chars_per_token),
+            int(config.ingest.chunk_overlap_tokens * chars_per_token),
+        )
+
+        checkpoints = self.path2checkpoints / "extraction" / path2json.stem
+        results = await asyncio.gather(
+            *(
+                self._settle(
+                    self._extract_chunk(
+                        chunk,
+                        checkpoints
+                        / f"{i}-{hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:16]}.json",
+                    )
+                )
+                for i, chunk in enumerate(chunks)
+            )
         )
-        json_data = entities_and_realations.model_dump()
+        self._raise_failed(results, f"Окна главы {chapter.name}")
+        json_data = self._merge_extractions(results)
 
         chapter_name = path2json.stem.split("_")[0]
         for edge in json_data["relationships"]:
             edge["chapter"] = chapter_name
 
-        path2json.write_text(
-            json.dumps(json_data, indent=4, ensure_ascii=False), encoding="utf-8"
-        )
+        self._write_json(path2json, json_data)
+        shutil.rmtree(checkpoints, ignore_errors=True)
 
     async def _process_summary_chapters(
         self, chapter: Path, name: str
     ) -> Dict[str, str]:
-        """Вспомогательная функция  для суммаризации главы"""
+        """Вспомогательная функция  для суммаризации главы (с контрольной точкой)"""
+
+        checkpoint = self.path2checkpoints / "summaries" / name
+        if checkpoint.exists():
+            return json.loads(checkpoint.read_text(encoding="utf-8"))
 
         chapter_content = chapter.read_text(encoding="utf-8")
         chapter_name = name.split("_")[0]
         chapter_summary = await self.llm.get_chapter_summary(chapter_content)
-        return {chapter_name: chapter_summary}
+        result = {chapter_name: chapter_summary}
+        self._write_json(checkpoint, result)
+        return result
 
     async def _extract_nodes_and_realtions(self) -> None:
-        """Извлечение вершин и связей из текста"""
+        """
+        Извлечение вершин и связей из текста.
+        Каждая глава (и каждое окно длинной главы) и каждая суммаризация
+        сохраняются отдельно, поэтому после сбоя повторный запуск доделывает
+        только недостающее.
+        """
 
         tasks_extract = []
         tasks_summary = []
@@ -75,40 +204,48 @@ class GrpahLoader:
 
                 if not path2json.exists():
                     tasks_extract.append(
-                        self._process_extract_nodes_and_edges(path2json, chapter)
+                        self._settle(
+                            self._process_extract_nodes_and_edges(path2json, chapter)
+                        )
                     )
 
                 if not self.path2summary.exists():
                     tasks_summary.append(
-                        self._process_summary_chapters(chapter, file_name)
+                        self._settle(self._process_summary_chapters(chapter, file_name))
                     )
 
+        extract_result = []
         if len(tasks_extract) > 0:
-            await tqdm_asyncio.gather(
-                *tasks_extract, desc="Nodes and realtions extracting processing"
-            )
+            with timed("ingest_extraction"):
+                extract_result = await tqdm_asyncio.gather(
+                    *tasks_extract, desc="Nodes and realtions extracting processing"
+                )
 
+        summary_result = []
         if len(tasks_summary) > 0:
-            summary_result = await tqdm_asyncio.gather(
-                *tasks_summary, desc="Chapters summaries processing"
-            )
+            with timed("ingest_summary"):
+                summary_result = await tqdm_asyncio.gather(
+                    *tasks_summary, desc="Chapters summaries processing"
+                )
+
+        self._raise_failed(extract_result, "Извлечение вершин и связей")
+        self._raise_failed(summary_result, "Суммаризация глав")
 
-            with open(self.path2summary, "w", encoding="utf-8") as f:
-                f.write(json.dumps(summary_result, indent=4, ensure_ascii=False))
+        if summary_result:
+            self._write_json(self.path2summary, summary_result)
+            shutil.rmtree(self.path2checkpoints / "summaries", ignore_errors=True)
 
     def _canonical_nodes(self, nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Дедупликация вершин"""
 
         self.names_map = {}  # key - non-canonical name, value - canonical name
-        names_map = json.load(open("./backend/data/names_map.json"))
         unique_nodes = []
         for node in nodes:
             if node["entity_type"] in {"персонаж", "person", "персона"}:
-                for key, value in names_map.items():
-                    if node["name"].lower() in value:
-                        self.names_map[node["name"].lower()] = key
-                        node["name"] = key
-                        break
+                canonical = self.alias_resolver.resolve(node["name"], fuzzy=False)
+                if canonical is not None:
+                    self.names_map[node["name"].lower()] = canonical
+                    node["name"] = canonical
             unique_nodes.append(node)
 
         return unique_nodes
@@ -168,6 +305,52 @@ class GrpahLoader:
 
         return edges
 
+    @staticmethod
+    def _relation_text(rel_type: str) -> str:
+        """Текст типа связи для эмбеддинга"""
+        return rel_type.strip("`").replace("_", " ")
+
+    async def _embed_texts(self, texts: List[str]) -> Dict[str, List[float]]:
+        """
+        Эмбеддинги уникальных текстов крупными пакетами с ограниченной
+        параллельностью (в обход микро-батчинга, который делит их на мелкие)
+        """
+
+        embedder = get_bulk_embedder(config)
+        unique = list(dict.fromkeys(text for text in texts if text))
+        batch_size = config.ingest.embedding_batch_size
+        batches = [
+            unique[i : i + batch_size] for i in range(0, len(unique), batch_size)
+        ]
+        semaphore = asyncio.Semaphore(config.ingest.embedding_concurrency)
+
+        async def embed(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await embedder.aembed_documents(batch)
+
+        results = await tqdm_asyncio.gather(
+            *(embed(batch) for batch in batches), desc="Edge embeddings processing"
+        )
+        logger.info(f"Эмбеддинги: {len(texts)} текстов, уникальных {len(unique)}")
+
+        vectors = {}
+        for batch, result in zip(batches, results):
+            vectors.update(zip(batch, result))
+        return vectors
+
+    async def _embed_edges(self, edges: List[Dict[str, Any]]) -> None:
+        """
+        Эмбеддинги типов и описаний связей (rel_embedding, desc_embedding);
+        для пустых текстов эмбеддинга нет - None
+        """
+
+        rel_texts = [self._relation_text(edge["relationship_type"]) for edge in edges]
+        descriptions = [edge.get("description", "") for edge in edges]
+        vectors = await self._embed_texts(rel_texts + descriptions)
+        for edge, rel_text, description in zip(edges, rel_texts, descriptions):
+            edge["rel_embedding"] = vectors.get(rel_text)
+            edge["desc_embedding"] = vectors.get(description)
+
     async def create_graph(self) -> None:
         """Создание графа знаний из текста"""
 
@@ -180,10 +363,13 @@ class GrpahLoader:
             nodes.extend(json_data["entities"])
             edges.extend(json_data["relationships"])
 
-        nodes = self._canonical_nodes(nodes)
-        nodes = self._merge_nodes(nodes)
+        with timed("ingest_canonicalization"):
+            nodes = self._canonical_nodes(nodes)
+            nodes = self._merge_nodes(nodes)
+            edges = self._normalize_edges(edges)
 
-        edges = self._normalize_edges(edges)
+        with timed("ingest_embeddings"):
+            await self._embed_edges(edges)
 
         with open("./backend/data/nodes.json", "w", encoding="utf-8") as f:
             f.write(json.dumps(nodes, indent=4, ensure_ascii=False))
@@ -202,16 +388,13 @@ class GrpahLoader:
         node_data = []
         for node in nodes:
             clean_name = re.sub(self.reg_expression, "_", node["name"]).strip("_")
-            node_data.append(
-                {
-                    "label": node["entity_type"],
-                    "properties": {
-                        "name": clean_name,
-                        "description": node.get("description", ""),
-                        "singular": node.get("singular", True),
-                    },
-                }
-            )
+            properties = {
+                "name": clean_name,
+                "description": node.get("description", ""),
+                "singular": node.get("singular", True),
+            }
+            properties["hash"] = content_hash([node["entity_type"], properties])
+            node_data.append({"label": node["entity_type"], "properties": properties})
 
         query = self.cypher_loader.load("load_nodes")
         params = {"nodes": node_data}
@@ -226,7 +409,7 @@ class GrpahLoader:
         if not edges:
             return "", {}
 
-        edge_data = []
+        edge_data = {}
         for edge in edges:
             rel_type = edge["relationship_type"]
             if (
@@ -245,40 +428,213 @@ class GrpahLoader:
                 "_",
                 self.names_map.get(edge["entity_2"], edge["entity_2"]),
             ).strip("_")
-            edge_data.append(
-                {
-                    "src_name": src_name,
-                    "tgt_name": tgt_name,
-                    "rel_type": rel_type,
-                    "description": edge.get("description", ""),
-                    "rel_embedding": edge.get("rel_embedding", []),
-                    "desc_embedding": edge.get("desc_embedding", []),
-                }
-            )
+            description = edge.get("description", "")
+            chapter = edge.get("chapter")
+            key = edge_key(src_name, rel_type, tgt_name, chapter, description)
+            # пустой список - не NULL для Cypher: отсутствующий эмбеддинг - None
+            rel_embedding = edge.get("rel_embedding") or None
+            desc_embedding = edge.get("desc_embedding") or None
+            edge_data[key] = {
+                "key": key,
+                "hash": content_hash([key, rel_embedding, desc_embedding]),
+                "src_name": src_name,
+                "tgt_name": tgt_name,
+                "rel_type": rel_type,
+                "chapter": chapter,
+                "description": description,
+                "rel_embedding": rel_embedding,
+                "desc_embedding": desc_embedding,
+            }
 
         query = self.cypher_loader.load("load_edges")
-        params = {"edges": edge_data}
+        params = {"edges": list(edge_data.values())}
 
         return query, params
 
-    def load2db(self) -> None:
-        """Загрузка графа знаний"""
+    def read_node_data(self) -> List[Dict[str, Any]]:
+        """Вершины в том виде, в котором они загружаются в граф знаний"""
         nodes = json.load(open("./backend/data/nodes.json"))
+        _, params_node = self._load_nodes(nodes)
+        return params_node["nodes"]
+
+    def read_graph_data(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Вершины и связи в том виде, в котором они загружаются в граф знаний"""
         edges = json.load(open("./backend/data/edges.json"))
+        _, params_edge = self._load_edges(edges)
+        return self.read_node_data(), params_edge.get("edges", [])
+
+    def fingerprint(self) -> str:
+        """Хэш sha256 версии загрузчика и содержимого nodes.json, edges.json и карты имен"""
+        digest = hashlib.sha256(f"loader:{LOADER_VERSION}".encode("utf-8"))
+        for path in (
+            "./backend/data/nodes.json",
+            "./backend/data/edges.json",
+            config.aliases.path,
+        ):
+            digest.update(path.encode("utf-8"))
+            if Path(path).exists():
+                digest.update(Path(path).read_bytes())
+        return digest.hexdigest()
+
+    def _run_batch(self, driver: Any, query: str, params: Dict[str, Any]) -> None:
+        """
+        Один пакет загрузки с повторами при временных ошибках Neo4j.
+        Запросы загрузки идемпотентны (MERGE по name/key), поэтому повтор
+        уже применённого пакета не создаёт дубликатов.
+        """
+        retries = config.ingest.retries
+        for attempt in range(retries + 1):
+            try:
+                driver.execute_query(query, params, database_=config.neo4j.database)
+                return
+            except (TransientError, ServiceUnavailable, SessionExpired) as e:
+                if attempt == retries:
+                    raise
+                delay = config.ingest.retry_delay * 2**attempt
+                logger.warning(
+                    f"Ошибка загрузки пакета ({e}), повтор через {delay:.1f} с"
+                )
+                time.sleep(delay)
+
+    def _run_batches(self, driver: Any, name: str, param: str, rows: List[Any]) -> None:
+        """
+        Выполнение запроса cypher/{name}.cypher по пакетам строк. Пакеты
+        независимы и выполняются параллельно в отдельных сессиях.
+        """
+        if not rows:
+            return
+
+        query = self.cypher_loader.load(name)
+        batch_size = config.ingest.batch_size
+        batches = [rows[i : i + batch_size] for i in range(0, len(rows), batch_size)]
+        start = time.perf_counter()
+        with (
+            timed(f"ingest_{name}"),
+            ThreadPoolExecutor(max_workers=config.ingest.parallelism) as executor,
+            tqdm(total=len(rows), desc=name, unit="rows") as progress,
+        ):
+            futures = {
+                executor.submit(self._run_batch, driver, query, {param: batch}): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                future.result()
+                ingest_rows.inc(len(futures[future]), query=name)
+                progress.update(len(futures[future]))
+
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"{name}: {len(rows)} строк за {elapsed:.1f} с "
+            f"({len(rows) / max(elapsed, 1e-9):.0f} строк/с)"
+        )
 
-        query_node, params_node = self._load_nodes(nodes)
-        query_edge, params_edge = self._load_edges(edges)
+    def _read_existing(
+        self, driver: Any
+    ) -> Tuple[Dict[str, str], Dict[str, Dict[str, str]]]:
+        """Вершины (имя -> hash) и связи (key -> концы и hash), уже загруженные в граф"""
+        database = config.neo4j.database
+        records, _, _ = driver.execute_query(
+            self.cypher_loader.load("existing_nodes"), database_=database
+        )
+        existing_nodes = {record["name"]: record["hash"] for record in records}
+        records, _, _ = driver.execute_query(
+            self.cypher_loader.load("existing_edges"), database_=database
+        )
+        existing_edges = {
+            record["key"]: {
+                "src_name": record["src_name"],
+                "tgt_name": record["tgt_name"],
+                "hash": record["hash"],
+            }
+            for record in records
+        }
+        return existing_nodes, existing_edges
+
+    def _apply_diff(self, driver: Any, diff: GraphDiff) -> None:
+        """Применение изменений: сначала удаления, затем вершины, затем связи"""
+        self._run_batches(driver, "delete_edges", "edges", diff.delete_edges)
+        self._run_batches(driver, "delete_nodes", "names", diff.delete_nodes)
+        self._run_batches(driver, "load_nodes", "nodes", diff.create_nodes)
+        self._run_batches(driver, "update_nodes", "nodes", diff.update_nodes)
+        self._run_batches(driver, "load_edges", "edges", diff.create_edges)
+        self._run_batches(driver, "update_edges", "edges", diff.update_edges)
+
+    def load2db(self, force: bool = False) -> None:
+        """
+        Загрузка графа знаний. Если отпечаток данных совпадает с сохраненным
+        в графе, загрузка пропускается. Иначе в граф вносятся только отличия
+        от текущего содержимого (force - очистить граф и загрузить заново;
+        граф без отпечатка или со старыми вершинами очищается всегда).
+        """
+        fingerprint = self.fingerprint()
+        self.graph_version = fingerprint
+        database = config.neo4j.database
 
         with GraphDatabase.driver(
             self.neo4j_uri, auth=(self.neo4j_username, self.neo4j_password)
         ) as driver:
-            driver.execute_query(self.cypher_loader.load("delete_db"), database="neo4j")
-            driver.execute_query(query_node, params_node, database="neo4j")
-            driver.execute_query(query_edge, params_edge, database="neo4j")
+            records, _, _ = driver.execute_query(
+                self.cypher_loader.load("get_fingerprint"), database_=database
+            )
+            if not force and records and records[0]["fingerprint"] == fingerprint:
+                logger.info("Граф актуален, загрузка пропущена")
+                return
+
+            nodes = json.load(open("./backend/data/nodes.json"))
+            edges = json.load(open("./backend/data/edges.json"))
+
+            with timed("ingest_prepare"):
+                _, params_node = self._load_nodes(nodes)
+                _, params_edge = self._load_edges(edges)
+                node_data = params_node["nodes"]
+                names = {node["properties"]["name"] for node in node_data}
+                # связи без вершин на концах в граф не попадут, в сравнении их не учитываем
+                edge_data = [
+                    edge
+                    for edge in params_edge.get("edges", [])
+                    if edge["src_name"] in names and edge["tgt_name"] in names
+                ]
+
+            with timed("ingest_load"):
+                # граф без отпечатка или с вершинами без метки сущность загружен
+                # до инкрементальной загрузки: сравнение их не увидит, граф очищается
+                legacy, _, _ = driver.execute_query(
+                    self.cypher_loader.load("count_legacy_nodes"), database_=database
+                )
+                if force or not records or legacy[0]["count"]:
+                    if not force:
+                        logger.info("Граф загружен старой версией, полная перезагрузка")
+                    driver.execute_query(
+                        self.cypher_loader.load("delete_db"), database_=database
+                    )
+                driver.execute_query(
+                    self.cypher_loader.load("create_schema"), database_=database
+                )
+                # связи, загруженные до появления ключей, пересоздаются
+                driver.execute_query(
+                    self.cypher_loader.load("delete_legacy_edges"), database_=database
+                )
+                existing_nodes, existing_edges = self._read_existing(driver)
+                diff = diff_graph(node_data, edge_data, existing_nodes, existing_edges)
+                logger.info(f"Изменения графа: {diff.summary()}")
+                # отпечаток снимается до изменений: прерванная загрузка повторится
+                driver.execute_query(
+                    self.cypher_loader.load("set_fingerprint"),
+                    {"fingerprint": None},
+                    database_=database,
+                )
+                self._apply_diff(driver, diff)
+                driver.execute_query(
+                    self.cypher_loader.load("set_fingerprint"),
+                    {"fingerprint": fingerprint},
+                    database_=database,
+                )
+            logger.info("Граф знаний загружен")
 
     async def pipeline(self) -> None:
         """Полный пайплайн по созданию графа знаний"""
 
         self.extractor.extract("./data/monte-cristo.txt")
-        await self.create_graph()
+        with llm_priority("ingestion"):
+            await self.create_graph()
         self.load2db()
@@ -1,5 +1,9 @@
 import os
-from typing import Dict, Optional, Any, List
+import asyncio
+import hashlib
+from typing import AsyncIterator, Callable, Dict, Optional, Any, List, Tuple
+import httpx
+import numpy as np
 from pydantic import SecretStr
 from omegaconf import DictConfig
 from dotenv import load_dotenv
@@ -16,12 +20,37 @@ from backend.utils.templates import (
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers.pydantic import PydanticOutputParser
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import Runnable
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.embeddings import Embeddings
 from backend.utils.models import EntitiesRelationships, CanonicalName, Query
+from backend.utils.metrics import (
+    cache_hits,
+    cache_misses,
+    embedding_calls,
+    embedding_texts,
+    llm_tokens,
+)
+from backend.utils.cache import LRUCache, SQLiteStore
+from backend.utils.concurrency import LLMScheduler, run_blocking
 
 load_dotenv()
 
 
+def _http_clients(config: DictConfig) -> Dict[str, Any]:
+    """HTTP-клиенты с настроенным пулом соединений для ChatOpenAI"""
+    limits = httpx.Limits(
+        max_connections=config.http_pool.max_connections,
+        max_keepalive_connections=config.http_pool.max_keepalive_connections,
+        keepalive_expiry=config.http_pool.keepalive_expiry,
+    )
+    return {
+        "http_client": httpx.Client(limits=limits),
+        "http_async_client": httpx.AsyncClient(limits=limits),
+    }
+
+
 class LLMDeepSeek(ChatOpenAI):
     def __init__(self, config: DictConfig):
         super().__init__(
@@ -31,8 +60,11 @@ class LLMDeepSeek(ChatOpenAI):
             temperature=config.llm.temperature,
             top_p=config.llm.top_p,
             presence_penalty=config.llm.repeat_penalty,
+            # с base_url ChatOpenAI не запрашивает usage в потоке сам
+            stream_usage=True,
             max_retries=3,
             timeout=60,
+            **_http_clients(config),
         )
 
 
@@ -45,6 +77,9 @@ class LLMMistral(ChatOpenAI):
             temperature=config.llm.temperature,
             top_p=config.llm.top_p,
             presence_penalty=config.llm.repeat_penalty,
+            # с base_url ChatOpenAI не запрашивает usage в потоке сам
+            stream_usage=True,
+            **_http_clients(config),
         )
 
 
@@ -53,69 +88,417 @@ class EmbeddingOllama(OllamaEmbeddings):
         super().__init__(
             base_url=os.environ.get("OLLAMA_URL", "http://localhost:11434"),
             model=config.embeddings.ollama_model_name,
+            client_kwargs={
+                "limits": httpx.Limits(
+                    max_connections=config.http_pool.max_connections,
+                    max_keepalive_connections=config.http_pool.max_keepalive_connections,
+                    keepalive_expiry=config.http_pool.keepalive_expiry,
+                )
+            },
         )
 
+
 class EmbeddingMistral(MistralAIEmbeddings):
     def __init__(self, config: DictConfig):
         super().__init__(
             api_key=SecretStr(os.environ.get("MISTRAL_API_KEY", "")),
-            model=config.embeddings.mistral_model_name
+            model=config.embeddings.mistral_model_name,
+        )
+
+
+class EmbeddingBatcher:
+    """
+    Асинхронный сервис эмбеддингов с микро-батчингом: тексты от параллельных
+    запросов копятся в течение короткого окна (или до порога размера) и
+    отправляются провайдеру одним вызовом, одинаковые тексты считаются один раз.
+    Если общий вызов не удался, тексты каждого вызывающего повторяются
+    отдельно, и ошибку получает только тот, чьи тексты ее вызывают.
+    """
+
+    def __init__(self, embeddings: Embeddings, window: float, max_batch_size: int):
+        self.embeddings = embeddings
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._callers: List[List[str]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # таймер и ожидающие от предыдущего цикла событий (asyncio.run) не нужны
+            self._loop = loop
+            self._timer = None
+            self._pending = {}
+            self._callers = []
+            self._batches = set()
+
+        futures = []
+        for text in texts:
+            future = self._pending.get(text)
+            if future is None:
+                future = loop.create_future()
+                self._pending[text] = future
+            futures.append(future)
+        self._callers.append(texts)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        # shield: отмена одного вызывающего не должна отменять общий батч
+        return list(await asyncio.gather(*map(asyncio.shield, futures)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, {}
+        callers, self._callers = self._callers, []
+        if batch:
+            task = asyncio.create_task(self._embed_batch(batch, callers))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _embed(self, texts: List[str], batch: Dict[str, asyncio.Future]) -> None:
+        """Эмбеддинги текстов пакетами по max_batch_size, результаты - в batch"""
+        for i in range(0, len(texts), self.max_batch_size):
+            chunk = texts[i : i + self.max_batch_size]
+            embedding_calls.inc()
+            embedding_texts.inc(len(chunk))
+            vectors = await self.embeddings.aembed_documents(chunk)
+            for text, vector in zip(chunk, vectors):
+                if not batch[text].done():
+                    batch[text].set_result(vector)
+
+    async def _embed_caller(
+        self, texts: List[str], batch: Dict[str, asyncio.Future]
+    ) -> None:
+        """Повтор текстов одного вызывающего, ошибка - только его текстам"""
+        texts = [text for text in dict.fromkeys(texts) if not batch[text].done()]
+        try:
+            await self._embed(texts, batch)
+        except Exception as e:
+            for text in texts:
+                if not batch[text].done():
+                    batch[text].set_exception(e)
+
+    async def _embed_batch(
+        self, batch: Dict[str, asyncio.Future], callers: List[List[str]]
+    ) -> None:
+        try:
+            await self._embed(list(batch), batch)
+        except Exception as e:
+            if len(callers) > 1:
+                await asyncio.gather(
+                    *(self._embed_caller(texts, batch) for texts in callers)
+                )
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Кэш эмбеддингов: LRU в памяти и SQLite на диске.
+    Ключ — имя модели эмбеддингов и sha256 текста. В памяти векторы хранятся
+    как массивы float32 и превращаются в списки только при выдаче.
+    """
+
+    def __init__(
+        self,
+        embeddings: Any,
+        model_name: str,
+        cache_size: int,
+        cache_path: Optional[str] = None,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.memory = LRUCache(cache_size)
+        self.disk = SQLiteStore(cache_path, table="embeddings") if cache_path else None
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            vector = self.memory.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                found[key] = vector
+
+        if missing and self.disk is not None:
+            for key, (value, _) in self.disk.get_many(missing).items():
+                # на диске векторы хранятся как float64
+                vector = np.frombuffer(value, dtype=np.float64).astype(np.float32)
+                self.memory.set(key, vector)
+                found[key] = vector
+
+        return found
+
+    def _store(self, vectors: Dict[str, np.ndarray]) -> None:
+        for key, vector in vectors.items():
+            self.memory.set(key, vector)
+        if self.disk is not None:
+            self.disk.set_many(
+                {
+                    key: vector.astype(np.float64).tobytes()
+                    for key, vector in vectors.items()
+                }
+            )
+
+    def _split(self, texts: List[str], found: Dict[str, np.ndarray]) -> Dict[str, str]:
+        """Тексты, которых нет в кэше (ключ -> текст)"""
+        missing = {}
+        for text in texts:
+            key = self._key(text)
+            if key not in found:
+                missing[key] = text
+        cache_hits.inc(len(texts) - len(missing), cache="embeddings")
+        cache_misses.inc(len(missing), cache="embeddings")
+        return missing
+
+    @staticmethod
+    def _computed(
+        missing: Dict[str, str], vectors: List[List[float]]
+    ) -> Dict[str, np.ndarray]:
+        return {
+            key: np.asarray(vector, dtype=np.float32)
+            for key, vector in zip(missing, vectors)
+        }
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+        missing = self._split(texts, found)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = self._computed(missing, vectors)
+            self._store(computed)
+            found.update(computed)
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        if self.disk is None:
+            found = self._lookup(keys)
+        else:
+            found = await run_blocking(self._lookup, keys)
+        missing = self._split(texts, found)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = self._computed(missing, vectors)
+            if self.disk is None:
+                self._store(computed)
+            else:
+                await run_blocking(self._store, computed)
+            found.update(computed)
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Учет потраченных токенов LLM в метриках"""
+
+    run_inline = True
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+                llm_tokens.inc(
+                    usage.get("input_tokens", 0), model=self.model_name, kind="input"
+                )
+                llm_tokens.inc(
+                    usage.get("output_tokens", 0), model=self.model_name, kind="output"
+                )
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler(config: DictConfig) -> LLMScheduler:
+    """Общий на процесс планировщик вызовов LLM"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler(
+            max_concurrency=config.llm_scheduler.max_concurrency,
+            reserved_interactive=config.llm_scheduler.reserved_interactive,
+            rate_limits=dict(config.llm_scheduler.rate_limits),
+            burst=config.llm_scheduler.burst,
+        )
+    return _scheduler
+
+
+_clients: Dict[Tuple[str, str], Any] = {}
+
+
+def _shared(kind: str, name: str, factory: Callable[[], Any]) -> Any:
+    """Один экземпляр клиента на процесс для вида и провайдера"""
+    client = _clients.get((kind, name))
+    if client is None:
+        client = factory()
+        _clients[(kind, name)] = client
+    return client
+
+
+def get_chat_model(config: DictConfig, llm_type: Optional[str] = None) -> ChatOpenAI:
+    """Общий клиент LLM провайдера (по умолчанию из config.llm.type)"""
+    llm_type = llm_type or config.llm.type
+    llm_map = {"mistral": LLMMistral, "deepseek": LLMDeepSeek}
+    return _shared("llm", llm_type, lambda: llm_map[llm_type](config))
+
+
+def get_embeddings(config: DictConfig, embeddings_type: Optional[str] = None) -> Any:
+    """Общий клиент эмбеддингов провайдера (по умолчанию из config.embeddings.type)"""
+    embeddings_type = embeddings_type or config.embeddings.type
+    embeddings_map = {"ollama": EmbeddingOllama, "mistral": EmbeddingMistral}
+    return _shared(
+        "embeddings", embeddings_type, lambda: embeddings_map[embeddings_type](config)
+    )
+
+
+def get_embedder(config: DictConfig) -> CachedEmbeddings:
+    """Общий сервис эмбеддингов с микро-батчингом и кэшем"""
+
+    def factory() -> CachedEmbeddings:
+        embeddings = get_embeddings(config)
+        return CachedEmbeddings(
+            EmbeddingBatcher(
+                embeddings,
+                window=config.embeddings.batch_window,
+                max_batch_size=config.embeddings.max_batch_size,
+            ),
+            model_name=embeddings.model,
+            cache_size=config.embeddings.cache_size,
+            cache_path=config.embeddings.cache_path,
         )
-    
+
+    return _shared("embedder", config.embeddings.type, factory)
+
+
+def get_bulk_embedder(config: DictConfig) -> CachedEmbeddings:
+    """
+    Сервис эмбеддингов для загрузки графа: тот же кэш, но без микро-батчинга -
+    пакеты вызывающего уходят провайдеру как есть
+    """
+
+    def factory() -> CachedEmbeddings:
+        embeddings = get_embeddings(config)
+        return CachedEmbeddings(
+            embeddings,
+            model_name=embeddings.model,
+            cache_size=config.embeddings.cache_size,
+            cache_path=config.embeddings.cache_path,
+        )
+
+    return _shared("bulk_embedder", config.embeddings.type, factory)
+
+
+STR_PARSER = StrOutputParser()
+ENTITIES_PARSER = PydanticOutputParser(pydantic_object=EntitiesRelationships)
+QUERY_PARSER = JsonOutputParser(
+    schema={"type": "array", "items": Query.model_json_schema()}
+)
+CANONICAL_NAMES_PARSER = JsonOutputParser(
+    schema={"type": "array", "items": CanonicalName.model_json_schema()}
+)
+
 
 class LLMWorker:
     def __init__(self, config: DictConfig) -> None:
-        llm_type = config.llm.type
-        llm_map = {"mistral": LLMMistral, "deepseek": LLMDeepSeek}
-        self.llm = llm_map.get(llm_type)(config)
+        self.llm = get_chat_model(config)
+        self.provider = config.llm.type
+        self.scheduler = get_scheduler(config)
+        self.callbacks = [TokenUsageHandler(self.llm.model_name)]
 
-        embeddings_type = config.embeddings.type
-        embeddings_map = {"ollama": EmbeddingOllama, "mistral": EmbeddingMistral}
-        self.embeddings = embeddings_map.get(embeddings_type)(config)
+        self.embeddings = get_embeddings(config)
+        self.embedder = get_embedder(config)
+        self._chains: Dict[Tuple[str, int], Runnable] = {}
 
         self.history = []
 
+    def _chain(self, template: str, parser: Any) -> Runnable:
+        """Цепочка prompt | llm | parser, собирается один раз на шаблон"""
+        key = (template, id(parser))
+        chain = self._chains.get(key)
+        if chain is None:
+            prompt = ChatPromptTemplate.from_template(template)
+            if "format_instructions" in prompt.input_variables:
+                prompt = prompt.partial(
+                    format_instructions=parser.get_format_instructions()
+                )
+            chain = prompt | self.llm | parser
+            self._chains[key] = chain
+        return chain
+
     async def _run_llm(
-        self,
-        input: Dict[str, str],
-        template: str,
-        parser: Optional[Any] = StrOutputParser(),
+        self, input: Dict[str, Any], template: str, parser: Any = STR_PARSER
     ) -> Any:
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = RunnablePassthrough() | prompt | self.llm | parser
-        return await chain.ainvoke(input)
+        chain = self._chain(template, parser)
+        async with self.scheduler.slot(self.provider):
+            return await chain.ainvoke(input, config={"callbacks": self.callbacks})
+
+    async def _stream_llm(
+        self, input: Dict[str, str], template: str
+    ) -> AsyncIterator[str]:
+        chain = self._chain(template, STR_PARSER)
+        async with self.scheduler.slot(self.provider):
+            async for chunk in chain.astream(
+                input, config={"callbacks": self.callbacks}
+            ):
+                yield chunk
 
     async def get_entities_and_relations(self, text: str) -> Any:
-        parser = PydanticOutputParser(pydantic_object=EntitiesRelationships)
-        input = {"text": text, "format_instructions": parser.get_format_instructions()}
         return await self._run_llm(
-            input=input, template=FEATURE_EXTRACT_TEMPLATE, parser=parser
+            input={"text": text},
+            template=FEATURE_EXTRACT_TEMPLATE,
+            parser=ENTITIES_PARSER,
         )
 
     async def get_struct_from_query(self, query: str):
         """Извлечение структуры из запроса пользователя"""
-        parser = JsonOutputParser(
-            schema={"type": "array", "items": Query.model_json_schema()}
-        )
-        input = {
-            "query": query,
-            "format_instructions": parser.get_format_instructions(),
-        }
         return await self._run_llm(
-            input=input, template=QUERY2GRAPH_TEMPLATE, parser=parser
+            input={"query": query}, template=QUERY2GRAPH_TEMPLATE, parser=QUERY_PARSER
         )
 
     async def get_canonical_names(self, names: list) -> Dict[str, List[str]]:
         """Получение канонических имен персонажей"""
-        parser = JsonOutputParser(
-            schema={"type": "array", "items": CanonicalName.model_json_schema()}
-        )
-        input = {
-            "names": names,
-            "format_instructions": parser.get_format_instructions(),
-        }
         return await self._run_llm(
-            input=input, template=CANONICAL_NAMES_TEMPLATE, parser=parser
+            input={"names": names},
+            template=CANONICAL_NAMES_TEMPLATE,
+            parser=CANONICAL_NAMES_PARSER,
         )
 
     async def get_chapter_summary(self, chapter: str) -> str:
@@ -129,3 +512,10 @@ class LLMWorker:
         return await self._run_llm(
             input={"context": context, "query": query}, template=ANSWER_TEMPLATE
         )
+
+    async def answer_stream(self, query: str, context: str) -> AsyncIterator[str]:
+        """Потоковое получение ответа на вопрос пользователя по данному контексту"""
+        async for chunk in self._stream_llm(
+            input={"context": context, "query": query}, template=ANSWER_TEMPLATE
+        ):
+            yield chunk
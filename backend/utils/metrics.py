@@ -0,0 +1,170 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """Монотонно растущий счетчик с метками"""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in self._values.items()
+            ]
+
+
+class Histogram:
+    """Гистограмма значений (например, длительностей) с метками"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            # счетчики по корзинам, затем сумма и общее количество
+            state = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state):
+                    labels = _format_labels(self.labels + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {state[-2]}")
+                lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик с выводом в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Counter | Histogram] = {}
+
+    def counter(
+        self, name: str, description: str, labels: Sequence[str] = ()
+    ) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, description, labels))
+
+    def histogram(
+        self, name: str, description: str, labels: Sequence[str] = ()
+    ) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, description, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "rag_stage_seconds", "Длительность этапов RAG и построения графа", ("stage",)
+)
+stage_errors = metrics.counter(
+    "rag_stage_errors_total", "Количество ошибок на этапах RAG", ("stage",)
+)
+requests_total = metrics.counter(
+    "rag_requests_total", "Количество запросов к RAG", ("mode",)
+)
+coalesced_requests = metrics.counter(
+    "rag_coalesced_requests_total",
+    "Запросы, объединенные с уже выполняющимся одинаковым запросом",
+)
+rejected_requests = metrics.counter(
+    "rag_rejected_requests_total",
+    "Запросы, отклоненные из-за перегрузки (HTTP 503)",
+    ("reason",),
+)
+cache_hits = metrics.counter("rag_cache_hits_total", "Попадания в кэш", ("cache",))
+cache_misses = metrics.counter("rag_cache_misses_total", "Промахи кэша", ("cache",))
+entity_extractions = metrics.counter(
+    "rag_entity_extractions_total",
+    "Извлечение сущностей из вопроса: по словарю или через LLM",
+    ("source",),
+)
+embedding_calls = metrics.counter(
+    "embedding_calls_total", "Количество вызовов провайдера эмбеддингов"
+)
+embedding_texts = metrics.counter(
+    "embedding_texts_total", "Количество текстов, отправленных на эмбеддинг"
+)
+ingest_rows = metrics.counter(
+    "ingest_rows_total", "Строки, загруженные в граф знаний", ("query",)
+)
+llm_queue_seconds = metrics.histogram(
+    "llm_queue_seconds", "Ожидание слота планировщика LLM", ("priority",)
+)
+llm_tokens = metrics.counter(
+    "llm_tokens_total", "Количество токенов LLM", ("model", "kind")
+)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Замер длительности этапа и учет ошибок"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
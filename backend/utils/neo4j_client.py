@@ -0,0 +1,46 @@
+import os
+import logging
+from typing import Any, Dict, List, Optional
+from omegaconf import DictConfig
+from neo4j import AsyncDriver, AsyncGraphDatabase, Record
+
+logger = logging.getLogger(__name__)
+
+
+class Neo4jClient:
+    """Долгоживущий асинхронный драйвер Neo4j с пулом соединений"""
+
+    def __init__(
+        self,
+        config: DictConfig,
+        neo4j_uri: str = os.environ.get("NEO4J_URI", "bolt://neo4j-db:7687"),
+        neo4j_username: str = os.environ.get("NEO4J_USERNAME", "neo4j"),
+        neo4j_password: str = os.environ.get("NEO4J_PASSWORD", "password123"),
+    ):
+        self.database = config.neo4j.database
+        self.driver: AsyncDriver = AsyncGraphDatabase.driver(
+            neo4j_uri,
+            auth=(neo4j_username, neo4j_password),
+            max_connection_pool_size=config.neo4j.max_connection_pool_size,
+            connection_acquisition_timeout=config.neo4j.connection_acquisition_timeout,
+            max_connection_lifetime=config.neo4j.max_connection_lifetime,
+        )
+
+    async def verify(self) -> None:
+        """Проверка соединения с Neo4j (прогрев пула)"""
+        await self.driver.verify_connectivity()
+        logger.info("Соединение с Neo4j установлено")
+
+    async def execute_query(
+        self, query: str, params: Optional[Dict[str, Any]] = None
+    ) -> List[Record]:
+        """Выполнение запроса через общий пул соединений"""
+        records, _, _ = await self.driver.execute_query(
+            query, params, database_=self.database
+        )
+        return records
+
+    async def close(self) -> None:
+        """Закрытие драйвера и всех соединений пула"""
+        await self.driver.close()
+        logger.info("Соединение с Neo4j закрыто")
@@ -1,94 +1,261 @@
 import re
 import os
-import json
+import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional, Tuple
-from pathlib import Path
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Dict, List, Any, Optional, Tuple
 from backend.utils.config_loader import config
 from backend.utils.graph_loader import GrpahLoader
-from neo4j import GraphDatabase
 from backend.utils.cypher_loader import CypherLoader
-from backend.utils.llm import LLMWorker
+from backend.utils.neo4j_client import Neo4jClient
+from backend.utils.graph_health import GraphHealth
+from backend.utils.alias_resolver import AliasResolver, normalize_text
+from backend.utils.cache import JSONCache
+from backend.utils.concurrency import SingleFlight, run_blocking
+from backend.utils.context_builder import ContextBuilder
+from backend.utils.edge_index import EdgeIndex
+from backend.utils.entity_matcher import EntityMatcher
+from backend.utils.metrics import (
+    cache_hits,
+    cache_misses,
+    entity_extractions,
+    requests_total,
+    timed,
+)
+from backend.utils.llm import LLMWorker, get_bulk_embedder
 from langchain_core.documents import Document
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
+class SemanticCache:
+    """
+    Кэш ответов по смысловой близости вопросов.
+    Эмбеддинги вопросов хранятся в одной матрице, поиск — одно умножение
+    матрицы на вектор. Записи действительны только для той версии графа,
+    для которой они были получены, и только для той же истории диалога
+    (context_key). Вытеснение — LRU.
+    """
+
+    def __init__(self, maxsize: int, threshold: float):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.graph_version: Optional[str] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._valid = np.zeros(maxsize, dtype=bool)
+        self._context_keys = np.empty(maxsize, dtype=object)
+        self._entries: OrderedDict[int, Dict[str, Any]] = OrderedDict()
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, graph_version: str) -> None:
+        """Сброс кэша при смене версии графа"""
+        if graph_version != self.graph_version:
+            self.clear()
+            self.graph_version = graph_version
+
+    def get(
+        self, embedding: List[float], graph_version: str, context_key: str
+    ) -> Optional[Dict[str, Any]]:
+        """Результат для самого похожего вопроса, если сходство выше порога"""
+        self._check_version(graph_version)
+        if self._entries and len(embedding) == self._matrix.shape[1]:
+            similarities = self._matrix @ self._unit(embedding)
+            similarities[~(self._valid & (self._context_keys == context_key))] = -np.inf
+            slot = int(np.argmax(similarities))
+            if similarities[slot] >= self.threshold:
+                self._entries.move_to_end(slot)
+                self.hits += 1
+                cache_hits.inc(cache="answers")
+                return dict(self._entries[slot])
+
+        self.misses += 1
+        cache_misses.inc(cache="answers")
+        return None
+
+    def set(
+        self,
+        embedding: List[float],
+        result: Dict[str, Any],
+        graph_version: str,
+        context_key: str,
+    ) -> None:
+        self._check_version(graph_version)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.maxsize, len(embedding)), dtype=np.float32)
+        if len(embedding) != self._matrix.shape[1]:
+            return
+
+        if len(self._entries) < self.maxsize:
+            slot = int(np.argmin(self._valid))
+        else:
+            slot, _ = self._entries.popitem(last=False)
+
+        self._matrix[slot] = self._unit(embedding)
+        self._valid[slot] = True
+        self._context_keys[slot] = context_key
+        self._entries[slot] = dict(result)
+
+    def clear(self) -> None:
+        self._valid[:] = False
+        self._entries.clear()
+
+
 class RAG:
     def __init__(
         self,
         neo4j_uri: str = os.environ.get("NEO4J_URI", "bolt://neo4j-db:7687"),
         neo4j_username: str = os.environ.get("NEO4J_USERNAME", "neo4j"),
         neo4j_password: str = os.environ.get("NEO4J_PASSWORD", "password123"),
-        database: str = "neo4j",
+        neo4j_client: Optional[Neo4jClient] = None,
     ):
         self.reg_expression = r"[^a-zA-Zа-яА-ЯёЁ0-9]"
         self.llm = LLMWorker(config)
         self.cypher_loader = CypherLoader()
-        self.neo4j_uri = neo4j_uri
-        self.neo4j_username = neo4j_username
-        self.neo4j_password = neo4j_password
-        self.database = database
-        self._names_map = None
-        self._load_names_map()
-        GrpahLoader().load2db()
-
-    def _load_names_map(self):
-        """Загружает карту имен из файла"""
-
-        names_map_path = Path("./backend/data/names_map.json")
-        if names_map_path.exists():
-            try:
-                self._names_map = json.loads(names_map_path.read_text(encoding="utf-8"))
-            except Exception as e:
-                logger.warning(f"Не удалось загрузить names_map.json: {e}")
-                self._names_map = {}
-        else:
-            logger.warning(
-                "Файл names_map.json не найден. Работаем без канонизации имен."
-            )
-            self._names_map = {}
+        self.neo4j_client = neo4j_client or Neo4jClient(
+            config, neo4j_uri, neo4j_username, neo4j_password
+        )
+        self.graph_health = GraphHealth(
+            self.neo4j_client, self.cypher_loader, config.graph_health.ttl
+        )
+        self.alias_resolver = AliasResolver.from_file(
+            config.aliases.path, config.aliases.min_similarity
+        )
+        self.query_cache = JSONCache(
+            maxsize=config.query_cache.size,
+            ttl=config.query_cache.ttl,
+            path=config.query_cache.path,
+            table="query_structs",
+        )
+        self.answer_cache = (
+            SemanticCache(config.answer_cache.size, config.answer_cache.threshold)
+            if config.answer_cache.enabled
+            else None
+        )
+        graph_loader = GrpahLoader(alias_resolver=self.alias_resolver)
+        graph_loader.load2db()
+        # состояние графа, проверенное до загрузки, устарело
+        self.graph_health.invalidate()
+        self.graph_version = graph_loader.graph_version
+        self._single_flight = SingleFlight()
+        self.context_builder = ContextBuilder(
+            max_tokens=config.context.max_tokens,
+            history_tokens=config.context.history_tokens,
+            mmr_lambda=config.context.mmr_lambda,
+            duplicate_threshold=config.context.duplicate_threshold,
+            chars_per_token=config.context.chars_per_token,
+            tokenizer=config.context.tokenizer,
+        )
+
+        self.edge_index = None
+        self.entity_matcher = None
+        node_data = None
+        if config.retrieval.engine == "numpy":
+            node_data, edge_data = graph_loader.read_graph_data()
+            self.edge_index = EdgeIndex.from_graph_data(node_data, edge_data)
+        if config.extraction.mode == "hybrid":
+            # словарю нужны только имена: связи (с хэшами эмбеддингов) не читаются
+            if node_data is None:
+                node_data = graph_loader.read_node_data()
+            names = [(node["properties"]["name"],) * 2 for node in node_data]
+            self.entity_matcher = EntityMatcher(names + self.alias_resolver.items())
+
+    def _history_key(
+        self, query: str, chat_history: Optional[List[Dict[str, str]]]
+    ) -> str:
+        """
+        Хэш истории чата до текущего вопроса: ответы, полученные в контексте
+        одного диалога, не должны достаться другому
+        """
+        history = list(chat_history or [])
+        if (
+            history
+            and history[-1]["role"] == "user"
+            and history[-1]["content"] == query
+        ):
+            history.pop()
+        text = self.context_builder.format_history(history)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
     def _canonicalize_entity(self, entity: str) -> str:
         """Преобразует имя сущности в каноническую форму"""
-        if not self._names_map:
-            return re.sub(self.reg_expression, "_", entity).strip("_")
-
-        for key, value in self._names_map.items():
-            if entity.lower() in value:
-                logger.info(f"entity: {entity}, value: {value}")
-                return re.sub(self.reg_expression, "_", key).strip("_")
+        canonical = self.alias_resolver.resolve(entity)
+        if canonical is not None:
+            logger.info(f"entity: {entity}, canonical: {canonical}")
+            entity = canonical
 
         return re.sub(self.reg_expression, "_", entity).strip("_")
 
-    def _check_graph_available(self) -> bool:
-        """Проверяет, доступен ли граф и содержит ли он данные с правильными метками"""
-        try:
-            with GraphDatabase.driver(
-                self.neo4j_uri, auth=(self.neo4j_username, self.neo4j_password)
-            ) as driver:
-                records, _, _ = driver.execute_query(
-                    self.cypher_loader.load("check"), database=self.database
-                )
-                node_count = records[0]["count"] if records else 0
-                has_data = node_count > 0
-                if not has_data:
-                    logger.info(
-                        "Граф доступен, но не содержит данных с нужными метками. Работаем в режиме LLM диалога."
-                    )
-                return has_data
-        except Exception as e:
-            logger.warning(f"Граф недоступен: {e}. Работаем в режиме LLM диалога.")
-            return False
+    def _match_entities(self, query: str) -> Optional[Dict[str, List[str]]]:
+        """
+        Быстрое извлечение сущностей по словарю имен без LLM.
+        Возвращает None, если сущности не найдены или уверенность низкая.
+        """
+        if self.entity_matcher is None:
+            return None
+
+        with timed("local_extraction"):
+            match = self.entity_matcher.extract(query)
+        if not match.entities or match.confidence < config.extraction.min_confidence:
+            return None
+
+        logger.info(
+            f"Сущности найдены по словарю: {match.entities} "
+            f"(уверенность {match.confidence}), предикаты: {match.predicates}"
+        )
+        return {"entities": match.entities, "relationship": match.predicates}
+
+    def _query_cache_key(self, query: str) -> str:
+        # канонические имена зависят от графа: ключ включает его версию
+        return f"{self.graph_version}:{normalize_text(query)}"
+
+    async def _extract_local(self, query: str) -> Optional[Dict[str, List[Any]]]:
+        """
+        Структура запроса из кэша или по словарю имен, без LLM.
+        Возвращает None, если нужен LLM.
+        """
+        cached = await self.query_cache.aget(self._query_cache_key(query))
+        if cached is not None:
+            cache_hits.inc(cache="query_struct")
+            logger.info(f"Структура запроса взята из кэша: {cached}")
+            return cached
+        cache_misses.inc(cache="query_struct")
+
+        json_query = self._match_entities(query)
+        if json_query is None:
+            return None
+        entity_extractions.inc(source="local")
+        return await self._store_struct(query, json_query)
 
     async def _extract_nodes_and_edges_from_query(
-        self, query: str
+        self, query: str, local: Optional[Awaitable] = None
     ) -> Dict[str, List[Any]]:
-        """Извлекает сущности и связи из запроса с использованием LLM"""
+        """
+        Извлекает сущности и связи из запроса (по словарю или с использованием LLM).
+        local - уже запущенный _extract_local для этого запроса.
+        """
+        result = await (local if local is not None else self._extract_local(query))
+        if result is not None:
+            return result
 
-        json_query = await self.llm.get_struct_from_query(query)
+        entity_extractions.inc(source="llm")
+        with timed("extraction"):
+            json_query = await self.llm.get_struct_from_query(query)
         logger.info(f"LLM вернул структуру: {json_query}")
+        return await self._store_struct(query, json_query)
 
+    async def _store_struct(
+        self, query: str, json_query: Dict[str, List[Any]]
+    ) -> Dict[str, List[Any]]:
+        """Канонизация сущностей структуры запроса и сохранение в кэш"""
         entities = json_query.get("entities", [])
         rels = json_query.get("relationship", [])
 
@@ -99,72 +266,220 @@ class RAG:
         ]
         logger.info(f"Канонизированные сущности: {clear_entities}")
 
-        return {"entities": clear_entities, "relationship": rels}
+        result = {"entities": clear_entities, "relationship": rels}
+        await self.query_cache.aset(self._query_cache_key(query), result)
+        return result
 
-    def _graph_retrieve(
-        self, query: str, json_query: Dict[str, List[Any]]
+    async def _embed_query(self, query: str) -> List[float]:
+        """Эмбеддинг вопроса пользователя"""
+        with timed("embeddings"):
+            return await self.llm.embedder.aembed_query(query)
+
+    async def _extract_and_embed_relationships(
+        self, query: str, local: Optional[Awaitable] = None
+    ) -> Tuple[Dict[str, List[Any]], List[List[float]]]:
+        """Извлечение структуры запроса и сразу же эмбеддинг найденных предикатов"""
+        json_query = await self._extract_nodes_and_edges_from_query(query, local)
+        rels = json_query.get("relationship", [])
+        logger.info(f"Получено связей: {len(rels)}")
+        with timed("embeddings"):
+            edge_embeddings = await self.llm.embedder.aembed_documents(rels)
+        return json_query, edge_embeddings
+
+    async def _graph_retrieve(
+        self,
+        json_query: Dict[str, List[Any]],
+        edge_embeddings: List[List[float]],
+        query_embedding: List[float],
     ) -> Tuple[List[Document], List[Dict[str, Any]]]:
         """
         Извлекает документы из графа Neo4j на основе сущностей.
         Возвращает кортеж: (документы, метаданные о найденных связях)
         """
         entities = json_query.get("entities", [])
-        rels = json_query.get("relationship", [])
-        logger.info(f"Получено связей: {len(rels)}")
-        edge_embeddings = self.llm.embeddings.embed_documents(rels)
-        query_embedding = self.llm.embeddings.embed_query(query)
         logger.info(f"Поиск в графе для сущностей: {entities}")
 
-        with GraphDatabase.driver(
-            self.neo4j_uri, auth=(self.neo4j_username, self.neo4j_password)
-        ) as driver:
-            query = self.cypher_loader.load("retrieve")
-            params = {
-                "entities": entities,
-                "edge_embeddings": edge_embeddings,
-                "query_embedding": query_embedding,
-            }
-            records, _, _ = driver.execute_query(query, params, database=self.database)
-
-            logger.info(f"Найдено записей в графе: {len(records)}")
-
-            documents = []
-            graph_metadata = []
-
-            for record in records:
-                text = f"{record['source']} {record['rel_type']} {record['target']}. {record.get('rel_desc', '')}"
-                documents.append(
-                    Document(
-                        page_content=text,
-                        metadata={
-                            "source": record["source"],
-                            "target": record["target"],
-                            "relation": record["rel_type"],
-                            "rel_desc": record.get("rel_desc", ""),
-                        },
-                    )
+        with timed("retrieval"):
+            if self.edge_index is not None:
+                records = await run_blocking(
+                    self.edge_index.search,
+                    entities,
+                    edge_embeddings,
+                    query_embedding,
+                    config.context.candidates,
                 )
-                graph_metadata.append(
-                    {
+            else:
+                query = self.cypher_loader.load("retrieve")
+                params = {
+                    "entities": entities,
+                    "edge_embeddings": edge_embeddings,
+                    "query_embedding": query_embedding,
+                    "limit": config.context.candidates,
+                }
+                records = await self.neo4j_client.execute_query(query, params)
+
+        logger.info(f"Найдено записей в графе: {len(records)}")
+        return self._to_documents(records)
+
+    async def _graph_retrieve_batch(
+        self, items: List[Dict[str, Any]], edge_embeddings: List[List[float]]
+    ) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Поиск в графе сразу для нескольких запросов одним вызовом.
+        items: {"id", "entities", "edge_ids" (индексы в edge_embeddings), "query_embedding"}
+        Возвращает записи по id запроса.
+        """
+        with timed("retrieval"):
+            if self.edge_index is not None:
+
+                def search_all() -> List[Dict[str, Any]]:
+                    return [
+                        {"id": item["id"], **record}
+                        for item in items
+                        for record in self.edge_index.search(
+                            item["entities"],
+                            [edge_embeddings[k] for k in item["edge_ids"]],
+                            item["query_embedding"],
+                            config.context.candidates,
+                        )
+                    ]
+
+                records = await run_blocking(search_all)
+            else:
+                query = self.cypher_loader.load("retrieve_batch")
+                params = {
+                    "items": items,
+                    "edge_embeddings": edge_embeddings,
+                    "limit": config.context.candidates,
+                }
+                records = await self.neo4j_client.execute_query(query, params)
+
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for record in records:
+            grouped.setdefault(record["id"], []).append(record)
+        logger.info(
+            f"Пакетный поиск в графе: {len(records)} записей для {len(items)} запросов"
+        )
+        return grouped
+
+    def _to_documents(
+        self, records: List[Any]
+    ) -> Tuple[List[Document], List[Dict[str, Any]]]:
+        """Документы и метаданные связей из записей поиска в графе"""
+
+        documents = []
+        graph_metadata = []
+
+        for record in records:
+            text = f"{record['source']} {record['rel_type']} {record['target']}. {record.get('rel_desc', '')}"
+            documents.append(
+                Document(
+                    page_content=text,
+                    metadata={
                         "source": record["source"],
                         "target": record["target"],
                         "relation": record["rel_type"],
-                        "description": record.get("rel_desc", ""),
-                    }
+                        "rel_desc": record.get("rel_desc", ""),
+                        "similarity": record.get("similarity"),
+                        "embedding": record.get("desc_embedding"),
+                    },
                 )
+            )
+            graph_metadata.append(
+                {
+                    "source": record["source"],
+                    "target": record["target"],
+                    "relation": record["rel_type"],
+                    "description": record.get("rel_desc", ""),
+                }
+            )
+
+        return documents, graph_metadata
 
-            return documents, graph_metadata
+    async def _retrieve(
+        self,
+        query: str,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        query_embedding: Optional[List[float]] = None,
+        extraction_task: Optional[asyncio.Task] = None,
+    ) -> Dict[str, Any]:
+        """
+        Поиск в графе и формирование контекста для ответа.
+        Возвращает словарь с контекстом для LLM и метаданными поиска.
+        """
+
+        # проверка графа, эмбеддинг вопроса и извлечение структуры (с эмбеддингом
+        # предикатов сразу по готовности) не зависят друг от друга
+        health_task = asyncio.create_task(self.graph_health.is_available())
+        if extraction_task is None:
+            extraction_task = asyncio.create_task(
+                self._extract_and_embed_relationships(query)
+            )
+        tasks = [health_task, extraction_task]
+        if query_embedding is None:
+            query_embedding_task = asyncio.create_task(self._embed_query(query))
+            tasks.append(query_embedding_task)
+        history_text = self.context_builder.format_history(chat_history)
+
+        try:
+            if not await health_task:
+                raise RuntimeError("Граф недоступен!")
+            query_nodes_and_edges, edge_embeddings = await extraction_task
+            if query_embedding is None:
+                query_embedding = await query_embedding_task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        documents, graph_metadata = await self._graph_retrieve(
+            query_nodes_and_edges, edge_embeddings, query_embedding
+        )
+        return self._build_context(
+            query_nodes_and_edges.get("entities", []),
+            documents,
+            graph_metadata,
+            history_text,
+        )
 
-    def _get_context(self, documents: List[Document]) -> str:
-        """Формирование контекста для ответа на запрос пользователя"""
+    def _build_context(
+        self,
+        entities_found: List[str],
+        documents: List[Document],
+        graph_metadata: List[Dict[str, Any]],
+        history_text: str,
+    ) -> Dict[str, Any]:
+        """Контекст для LLM и метаданные поиска из найденных документов"""
+
+        if not documents:
+            context = "В базе знаний не найдено информации по данному вопросу."
+            if history_text:
+                context = f"{context}\n\nПредыдущий контекст разговора:\n{history_text}"
+
+            return {
+                "context": context,
+                "graph_metadata": [],
+                "entities_found": entities_found,
+                "context_used": [],
+                "llm_context": [],
+                "context_tokens": self.context_builder.count_tokens(context),
+            }
 
-        context = ""
+        context, selected = self.context_builder.build(
+            documents, reserved_tokens=self.context_builder.count_tokens(history_text)
+        )
+        logger.info(f"В контекст отобрано связей: {len(selected)} из {len(documents)}")
 
-        for i, doc in enumerate(documents):
-            context += "-" * 40
-            context += f"\n{i + 1}. {doc.page_content}"
+        if history_text:
+            context = f"Предыдущий контекст разговора:\n{history_text}\n\nАктуальный контекст:\n{context}"
 
-        return context
+        return {
+            "context": context,
+            "graph_metadata": [graph_metadata[i] for i in selected],
+            "entities_found": entities_found,
+            "context_used": [documents[i].page_content for i in selected],
+            "context_tokens": self.context_builder.count_tokens(context),
+        }
 
     async def run(
         self, query: str, chat_history: Optional[List[Dict[str, str]]] = None
@@ -188,49 +503,285 @@ class RAG:
             }
         """
 
-        if not self._check_graph_available():
-            raise RuntimeError("Граф недоступен!")
+        requests_total.inc(mode="run")
+        # объединяются только одинаковые вопросы с одинаковой историей
+        key = (normalize_text(query), self._history_key(query, chat_history))
+        result = await self._single_flight.do(
+            key, lambda: self._run(query, chat_history)
+        )
+        return dict(result)
 
-        query_nodes_and_edges = await self._extract_nodes_and_edges_from_query(query)
-        entities_found = query_nodes_and_edges.get("entities", [])
+    async def _run(
+        self, query: str, chat_history: Optional[List[Dict[str, str]]] = None
+    ) -> Dict[str, Any]:
+        """Выполнение RAG запроса (одинаковые параллельные запросы объединяются в run)"""
 
-        documents, graph_metadata = self._graph_retrieve(
-            query=query, json_query=query_nodes_and_edges
+        history_key = self._history_key(query, chat_history)
+        cached, query_embedding, extraction_task = await self._lookup_answer(
+            query, history_key
         )
+        if cached is not None:
+            return cached
 
-        if not documents:
-            context = "В базе знаний не найдено информации по данному вопросу."
-            if chat_history:
-                history_text = "\n".join(
-                    [f"{msg['role']}: {msg['content']}" for msg in chat_history[-5:]]
+        retrieved = await self._retrieve(
+            query, chat_history, query_embedding, extraction_task
+        )
+        context = retrieved.pop("context")
+        with timed("answer"):
+            answer = await self.llm.answer(query=query, context=context)
+
+        result = {"answer": answer, **retrieved}
+        if self.answer_cache is not None:
+            self.answer_cache.set(
+                query_embedding, result, self.graph_version, history_key
+            )
+        return result
+
+    async def _lookup_answer(
+        self, query: str, history_key: str
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]], Optional[asyncio.Task]]:
+        """
+        Поиск ответа в семантическом кэше. Одновременно с эмбеддингом вопроса
+        выполняются только дешевые шаги извлечения структуры (кэш, словарь);
+        LLM вызывается лишь при промахе, чтобы попадания не тратили лимиты.
+        Возвращает (ответ из кэша, эмбеддинг вопроса, задача извлечения).
+        """
+        if self.answer_cache is None:
+            extraction_task = asyncio.create_task(
+                self._extract_and_embed_relationships(query)
+            )
+            return None, None, extraction_task
+
+        local_task = asyncio.create_task(self._extract_local(query))
+        try:
+            query_embedding = await self._embed_query(query)
+            cached = self.answer_cache.get(
+                query_embedding, self.graph_version, history_key
+            )
+        except BaseException:
+            local_task.cancel()
+            raise
+        if cached is None:
+            extraction_task = asyncio.create_task(
+                self._extract_and_embed_relationships(query, local_task)
+            )
+            return None, query_embedding, extraction_task
+
+        logger.info("Ответ взят из семантического кэша")
+        local_task.cancel()
+        await asyncio.gather(local_task, return_exceptions=True)
+        return cached, query_embedding, None
+
+    async def run_stream(
+        self, query: str, chat_history: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый вариант run().
+        Сначала отдает событие "metadata" с результатами поиска в графе,
+        затем события "token" с фрагментами ответа и в конце "done" с полным результатом.
+        """
+
+        requests_total.inc(mode="stream")
+        history_key = self._history_key(query, chat_history)
+        cached, query_embedding, extraction_task = await self._lookup_answer(
+            query, history_key
+        )
+        if cached is not None:
+            answer = cached.pop("answer")
+            yield {"event": "metadata", "data": cached}
+            yield {"event": "token", "data": answer}
+            yield {"event": "done", "data": {"answer": answer, **cached}}
+            return
+
+        retrieved = await self._retrieve(
+            query, chat_history, query_embedding, extraction_task
+        )
+        context = retrieved.pop("context")
+        yield {"event": "metadata", "data": retrieved}
+
+        chunks = []
+        with timed("answer"):
+            async for chunk in self.llm.answer_stream(query=query, context=context):
+                chunks.append(chunk)
+                yield {"event": "token", "data": chunk}
+
+        result = {"answer": "".join(chunks), **retrieved}
+        if self.answer_cache is not None:
+            self.answer_cache.set(
+                query_embedding, result, self.graph_version, history_key
+            )
+        yield {"event": "done", "data": result}
+
+    async def run_batch(
+        self, questions: List[str], concurrency: int
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Пакетная обработка вопросов без истории чата.
+        Одинаковые (после нормализации) вопросы обрабатываются один раз,
+        эмбеддинги вопросов и предикатов считаются общими вызовами, поиск в графе
+        выполняется одним запросом, ответы генерируются не более concurrency
+        одновременно. Результаты отдаются по готовности:
+        {"index": позиция в questions, "question": str, ...результат run()}
+        или {"index", "question", "error": str} при ошибке.
+        """
+
+        requests_total.inc(len(questions), mode="batch")
+        groups: Dict[str, List[int]] = {}
+        for i, question in enumerate(questions):
+            groups.setdefault(normalize_text(question), []).append(i)
+        positions = list(groups.values())
+        unique = [questions[indices[0]] for indices in positions]
+        logger.info(f"Пакет: {len(questions)} вопросов, уникальных {len(unique)}")
+
+        query_embeddings = await self._embed_isolated(unique, concurrency)
+
+        # вопросы пакета задаются без истории чата
+        history_key = self._history_key("", None)
+        pending = []
+        for j, query_embedding in enumerate(query_embeddings):
+            if isinstance(query_embedding, Exception):
+                for i in positions[j]:
+                    yield {
+                        "index": i,
+                        "question": questions[i],
+                        "error": str(query_embedding),
+                    }
+                continue
+            cached = None
+            if self.answer_cache is not None:
+                cached = self.answer_cache.get(
+                    query_embedding, self.graph_version, history_key
                 )
-                context = f"{context}\n\nПредыдущий контекст разговора:\n{history_text}"
+            if cached is None:
+                pending.append(j)
+                continue
+            for i in positions[j]:
+                yield {"index": i, "question": questions[i], **cached}
+
+        if not pending:
+            return
+        if not await self.graph_health.is_available():
+            raise RuntimeError("Граф недоступен!")
 
-            answer = await self.llm.answer(query=query, context=context)
-            return {
-                "answer": answer,
-                "graph_metadata": [],
-                "entities_found": entities_found,
-                "context_used": [],
-                "llm_context": [],
-            }
+        semaphore = asyncio.Semaphore(concurrency)
 
-        context = self._get_context(documents)
+        async def extract(j: int) -> Any:
+            try:
+                async with semaphore:
+                    return await self._extract_nodes_and_edges_from_query(unique[j])
+            except Exception as e:
+                logger.error(f"Ошибка при разборе вопроса пакета: {e}", exc_info=True)
+                return e
 
-        if chat_history:
-            history_text = "\n".join(
-                [f"{msg['role']}: {msg['content']}" for msg in chat_history[-5:]]
+        structs = dict(
+            zip(pending, await asyncio.gather(*(extract(j) for j in pending)))
+        )
+
+        predicates = list(
+            dict.fromkeys(
+                rel
+                for struct in structs.values()
+                if not isinstance(struct, Exception)
+                for rel in struct.get("relationship", [])
             )
-            context = f"Предыдущий контекст разговора:\n{history_text}\n\nАктуальный контекст:\n{context}"
+        )
+        edge_embeddings = await self._embed_isolated(predicates, concurrency)
+        predicate_ids = {predicate: k for k, predicate in enumerate(predicates)}
+
+        items = []
+        for j, struct in structs.items():
+            if not isinstance(struct, Exception):
+                edge_ids = [
+                    predicate_ids[rel] for rel in struct.get("relationship", [])
+                ]
+                failed = [
+                    edge_embeddings[k]
+                    for k in edge_ids
+                    if isinstance(edge_embeddings[k], Exception)
+                ]
+                if failed:
+                    struct = failed[0]
+            if isinstance(struct, Exception):
+                for i in positions[j]:
+                    yield {"index": i, "question": questions[i], "error": str(struct)}
+                continue
+            items.append(
+                {
+                    "id": j,
+                    "entities": struct.get("entities", []),
+                    "edge_ids": edge_ids,
+                    "query_embedding": query_embeddings[j],
+                }
+            )
+        if not items:
+            return
 
-        answer = await self.llm.answer(query=query, context=context)
+        # неполученные эмбеддинги предикатов оставшимися вопросами не используются
+        edge_embeddings = [
+            None if isinstance(embedding, Exception) else embedding
+            for embedding in edge_embeddings
+        ]
+        records = await self._graph_retrieve_batch(items, edge_embeddings)
 
-        return {
-            "answer": answer,
-            "graph_metadata": graph_metadata,
-            "entities_found": entities_found,
-            "context_used": [doc.page_content for doc in documents],
-        }
+        async def answer(j: int, entities: List[str]) -> Tuple[int, Dict[str, Any]]:
+            documents, graph_metadata = self._to_documents(records.get(j, []))
+            retrieved = self._build_context(entities, documents, graph_metadata, "")
+            context = retrieved.pop("context")
+            try:
+                async with semaphore:
+                    with timed("answer"):
+                        answer = await self.llm.answer(query=unique[j], context=context)
+            except Exception as e:
+                logger.error(f"Ошибка при ответе на вопрос пакета: {e}", exc_info=True)
+                return j, {"error": str(e)}
+
+            result = {"answer": answer, **retrieved}
+            if self.answer_cache is not None:
+                self.answer_cache.set(
+                    query_embeddings[j], result, self.graph_version, history_key
+                )
+            return j, result
+
+        tasks = [
+            asyncio.create_task(answer(item["id"], item["entities"])) for item in items
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                j, result = await next_done
+                for i in positions[j]:
+                    yield {"index": i, "question": questions[i], **result}
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _embed_isolated(self, texts: List[str], concurrency: int) -> List[Any]:
+        """
+        Эмбеддинги текстов одним вызовом провайдера, а если он не удался -
+        по одному (не более concurrency одновременно), чтобы ошибка на одном
+        тексте не затронула остальные. Вызовы идут в обход микро-батчинга,
+        который объединил бы их снова. На месте текстов, для которых
+        эмбеддинг не получен, - исключение.
+        """
+        if not texts:
+            return []
+        embedder = get_bulk_embedder(config)
+        try:
+            with timed("embeddings"):
+                return await embedder.aembed_documents(texts)
+        except Exception as e:
+            logger.warning(f"Ошибка пакетного эмбеддинга ({e}), повтор по одному")
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def embed(text: str) -> List[float]:
+            async with semaphore:
+                return (await embedder.aembed_documents([text]))[0]
+
+        with timed("embeddings"):
+            return await asyncio.gather(
+                *(embed(text) for text in texts), return_exceptions=True
+            )
 
     async def answer(
         self, query: str, chat_history: Optional[List[Dict[str, str]]] = None
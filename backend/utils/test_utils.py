@@ -9,10 +9,11 @@ from ragas.metrics import (
 )
 from ragas import evaluate
 from backend.utils.config_loader import config
-from backend.utils.llm import EmbeddingMistral, LLMMistral
+from backend.utils.llm import get_chat_model, get_embeddings
 from datasets import Dataset
 from tqdm.asyncio import tqdm_asyncio
 from backend.utils.rag import RAG
+from backend.utils.concurrency import llm_priority
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,8 +22,8 @@ load_dotenv()
 class TestRAG:
     def __init__(self):
         self.test_dataset = json.load(open("./backend/data/test/questions.json"))
-        self.llm = LLMMistral(config)
-        self.embeddings = EmbeddingMistral(config)
+        self.llm = get_chat_model(config, "mistral")
+        self.embeddings = get_embeddings(config, "mistral")
         self.rag = RAG()
         os.environ["RAGAS_DISABLE_ASYNC"] = "1"
         
@@ -31,7 +32,10 @@ class TestRAG:
         tasks = [self.rag.run(query=item) for item in self.test_dataset["question"]]
 
         if len(tasks) > 0:
-            results = await tqdm_asyncio.gather(*tasks, desc="RAG answer processing")
+            with llm_priority("evaluation"):
+                results = await tqdm_asyncio.gather(
+                    *tasks, desc="RAG answer processing"
+                )
             for i, r in enumerate(results):
                 print("ANSWER:", r["answer"])
                 self.test_dataset["contexts"][i] = r["context_used"]
@@ -98,6 +98,37 @@ class TextExtractor:
             "content_length": len(full_content),
         }
 
+    def split(self, text: str, max_chars: int, overlap_chars: int) -> List[str]:
+        """
+        Разбиение текста на окна не длиннее max_chars, соседние окна
+        перекрываются примерно на overlap_chars. Окна по возможности
+        заканчиваются на границе абзаца или предложения.
+        """
+        if not 0 <= overlap_chars < max_chars:
+            raise ValueError(
+                f"Перекрытие окон ({overlap_chars}) должно быть неотрицательным "
+                f"и меньше размера окна ({max_chars})"
+            )
+        if len(text) <= max_chars:
+            return [text]
+
+        chunks = []
+        start = 0
+        while True:
+            end = min(start + max_chars, len(text))
+            if end < len(text):
+                cut = max(text.rfind("\n", start, end), text.rfind(". ", start, end))
+                if cut > start + overlap_chars:
+                    end = cut + 1
+            chunks.append(text[start:end].strip())
+            if end >= len(text):
+                return chunks
+
+            start = end - overlap_chars
+            space = text.find(" ", start, end)
+            if space != -1:
+                start = space + 1
+
     def roman2arabic(self, roman: str) -> int:
         roman_numerals = {
             "I": 1,
@@ -0,0 +1,3 @@
+MATCH (n)
+WHERE NOT n:сущность AND NOT n:метаданные
+RETURN count(n) AS count
\ No newline at end of file
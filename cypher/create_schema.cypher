@@ -0,0 +1,2 @@
+CREATE CONSTRAINT entity_name IF NOT EXISTS
+FOR (n:сущность) REQUIRE n.name IS UNIQUE
\ No newline at end of file
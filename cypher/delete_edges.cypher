@@ -0,0 +1,4 @@
+UNWIND $edges AS edge
+MATCH (:сущность {name: edge.src_name})-[r]->(:сущность {name: edge.tgt_name})
+WHERE r.key = edge.key
+DELETE r
\ No newline at end of file
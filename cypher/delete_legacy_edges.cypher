@@ -0,0 +1,3 @@
+MATCH (:сущность)-[r]->(:сущность)
+WHERE r.key IS NULL
+DELETE r
\ No newline at end of file
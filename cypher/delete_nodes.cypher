@@ -0,0 +1,3 @@
+UNWIND $names AS name
+MATCH (n:сущность {name: name})
+DETACH DELETE n
\ No newline at end of file
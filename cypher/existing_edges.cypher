@@ -0,0 +1,3 @@
+MATCH (a:сущность)-[r]->(b:сущность)
+WHERE r.key IS NOT NULL
+RETURN r.key AS key, r.hash AS hash, a.name AS src_name, b.name AS tgt_name
\ No newline at end of file
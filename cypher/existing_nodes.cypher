@@ -0,0 +1,2 @@
+MATCH (n:сущность)
+RETURN n.name AS name, n.hash AS hash
\ No newline at end of file
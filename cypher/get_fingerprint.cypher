@@ -0,0 +1,2 @@
+MATCH (m:метаданные {key: "graph"})
+RETURN m.fingerprint AS fingerprint
\ No newline at end of file
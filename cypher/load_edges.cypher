@@ -1,13 +1,19 @@
 UNWIND $edges AS edge
-MATCH (a {name: edge.src_name})
-MATCH (b {name: edge.tgt_name})
+MATCH (a:сущность {name: edge.src_name})
+MATCH (b:сущность {name: edge.tgt_name})
 CALL apoc.merge.relationship(
-    a, 
-    edge.rel_type, 
-    {},
-    {description: edge.description, rel_embedding: edge.rel_embedding, desc_embedding: edge.desc_embedding},
+    a,
+    edge.rel_type,
+    {key: edge.key},
+    {
+        hash: edge.hash,
+        chapter: edge.chapter,
+        description: edge.description,
+        rel_embedding: edge.rel_embedding,
+        desc_embedding: edge.desc_embedding
+    },
     b,
-    {description: edge.description, rel_embedding: edge.rel_embedding, desc_embedding: edge.desc_embedding}
+    {}
 )
 YIELD rel
 RETURN count(rel) AS created
\ No newline at end of file
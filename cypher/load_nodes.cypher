@@ -1,4 +1,4 @@
 UNWIND $nodes AS node
-CALL apoc.create.node([node.label], node.properties)
+CALL apoc.merge.node([node.label, "сущность"], {name: node.properties.name}, node.properties, {})
 YIELD node AS created
 RETURN count(created) AS created_nodes
\ No newline at end of file
@@ -1,5 +1,5 @@
 UNWIND $entities AS canon_name
-MATCH (start {name: canon_name})
+MATCH (start:сущность {name: canon_name})
 WHERE start:персонаж OR start:место OR start:предмет OR start:организация 
 OPTIONAL MATCH (start)-[r]-(target)
 WITH start, r, target
@@ -14,9 +14,9 @@ WITH start, r, target,
     END AS desc_similarity
 
 WITH start, r, target, desc_similarity
-UNWIND $edge_embeddings AS edge_embedding
+UNWIND CASE WHEN size($edge_embeddings) = 0 THEN [null] ELSE $edge_embeddings END AS edge_embedding
 WITH start, r, target, desc_similarity, edge_embedding,
-    CASE WHEN r.rel_embedding IS NOT NULL
+    CASE WHEN r.rel_embedding IS NOT NULL AND edge_embedding IS NOT NULL
          THEN vector.similarity.cosine(r.rel_embedding, edge_embedding)
          ELSE 0.0
     END AS rel_similarity
@@ -37,6 +37,7 @@ RETURN
   desc_similarity,
   start.entity_type AS source_type,
   target.entity_type AS target_type,
-  r.chapter AS chapter
+  r.chapter AS chapter,
+  r.desc_embedding AS desc_embedding
 ORDER BY max_combined_similarity DESC
-LIMIT 10
\ No newline at end of file
+LIMIT $limit
\ No newline at end of file
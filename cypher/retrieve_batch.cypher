@@ -0,0 +1,58 @@
+UNWIND $items AS item
+CALL {
+  WITH item
+  UNWIND item.entities AS canon_name
+  MATCH (start:сущность {name: canon_name})
+  WHERE start:персонаж OR start:место OR start:предмет OR start:организация 
+  OPTIONAL MATCH (start)-[r]-(target)
+  WITH item, start, r, target
+  WHERE r IS NOT NULL 
+    AND r.description IS NOT NULL
+    AND (r.rel_embedding IS NOT NULL OR r.desc_embedding IS NOT NULL)
+
+  WITH item, start, r, target,
+      CASE WHEN r.desc_embedding IS NOT NULL AND item.query_embedding IS NOT NULL
+           THEN vector.similarity.cosine(r.desc_embedding, item.query_embedding)
+           ELSE 0.0
+      END AS desc_similarity
+
+  WITH start, r, target, desc_similarity,
+      [edge_id IN item.edge_ids | $edge_embeddings[edge_id]] AS edge_embeddings
+  UNWIND CASE WHEN size(edge_embeddings) = 0 THEN [null] ELSE edge_embeddings END AS edge_embedding
+  WITH start, r, target, desc_similarity, edge_embedding,
+      CASE WHEN r.rel_embedding IS NOT NULL AND edge_embedding IS NOT NULL
+           THEN vector.similarity.cosine(r.rel_embedding, edge_embedding)
+           ELSE 0.0
+      END AS rel_similarity
+
+  WITH start, r, target, desc_similarity,
+       MAX(0.5 * desc_similarity + 0.5 * rel_similarity) AS max_combined_similarity
+
+  RETURN 
+    start.name AS source,
+    type(r) AS rel_type,
+    r.description AS rel_desc,
+    target.name AS target,
+    target.description AS tgt_desc,
+    max_combined_similarity AS similarity,
+    desc_similarity,
+    start.entity_type AS source_type,
+    target.entity_type AS target_type,
+    r.chapter AS chapter,
+    r.desc_embedding AS desc_embedding
+  ORDER BY max_combined_similarity DESC
+  LIMIT $limit
+}
+RETURN
+  item.id AS id,
+  source,
+  rel_type,
+  rel_desc,
+  target,
+  tgt_desc,
+  similarity,
+  desc_similarity,
+  source_type,
+  target_type,
+  chapter,
+  desc_embedding
\ No newline at end of file
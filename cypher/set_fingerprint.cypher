@@ -0,0 +1,2 @@
+MERGE (m:метаданные {key: "graph"})
+SET m.fingerprint = $fingerprint, m.loaded_at = datetime()
\ No newline at end of file
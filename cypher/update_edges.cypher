@@ -0,0 +1,7 @@
+UNWIND $edges AS edge
+MATCH (:сущность {name: edge.src_name})-[r]->(:сущность {name: edge.tgt_name})
+WHERE r.key = edge.key
+SET r.hash = edge.hash,
+    r.rel_embedding = edge.rel_embedding,
+    r.desc_embedding = edge.desc_embedding
+RETURN count(r) AS updated
\ No newline at end of file
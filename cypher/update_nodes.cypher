@@ -0,0 +1,9 @@
+UNWIND $nodes AS node
+MATCH (n:сущность {name: node.properties.name})
+SET n = node.properties
+WITH n, node
+CALL apoc.create.removeLabels(n, [label IN labels(n) WHERE label <> "сущность"])
+YIELD node AS cleared
+CALL apoc.create.addLabels(cleared, [node.label])
+YIELD node AS updated
+RETURN count(updated) AS updated_nodes
\ No newline at end of file